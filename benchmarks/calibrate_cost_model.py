@@ -0,0 +1,95 @@
+"""
+Calibrate the server's cost model on this host.
+
+Times a grid of sizes and batch sizes with the same batched loop the server
+uses and writes the fitted coefficients to a JSON file. Point the server at
+it with COST_MODEL_PATH so /api/estimate and job ETAs are accurate from the
+first request.
+
+    python benchmarks/calibrate_cost_model.py --output /tmp/cost_model.json
+"""
+import argparse
+import os
+import sys
+
+import torch
+from diffusers import StableDiffusionPipeline
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.cost_model import CostModel, StepTimer, module_bytes
+from pipeline.engine import generate_batch, make_generator
+from pipeline.schedulers import create_scheduler
+
+
+def parse_list(value, cast=int):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the latency/memory cost model on this host")
+    parser.add_argument("--model", type=str, default="runwayml/stable-diffusion-v1-5", help="Base model")
+    parser.add_argument("--lora_dir", type=str, default=None, help="Optional LoRA weights directory")
+    parser.add_argument("--sizes", type=str, default="384x384,512x512,768x768", help="WIDTHxHEIGHT list")
+    parser.add_argument("--batch_sizes", type=str, default="1,2", help="Batch sizes to time")
+    parser.add_argument("--steps", type=int, default=6, help="Denoising steps per run")
+    parser.add_argument("--output", type=str, default="/tmp/cost_model.json", help="Calibration file")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"📥 Loading pipeline on {device}...")
+    pipe = StableDiffusionPipeline.from_pretrained(
+        args.model,
+        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+        safety_checker=None,
+        requires_safety_checker=False
+    )
+    if args.lora_dir:
+        pipe.load_lora_weights(args.lora_dir)
+        pipe.fuse_lora()
+        pipe.unload_lora_weights()
+    pipe.scheduler = create_scheduler("dpmpp_2m", pipe.scheduler.config)
+    pipe = pipe.to(device)
+
+    model = CostModel(
+        weights_bytes=module_bytes(pipe.unet, pipe.vae, pipe.text_encoder),
+        dtype_bytes=2 if device == "cuda" else 4,
+        quadratic_attention=not hasattr(torch.nn.functional, "scaled_dot_product_attention"),
+    )
+    sizes = [tuple(int(v) for v in size.lower().split("x")) for size in args.sizes.split(",") if size.strip()]
+
+    # One untimed run so one-off initialisation does not land in the fit
+    generate_batch(pipe, ["a ceramic vase"], [""], [7.5], [make_generator(0)[0]], steps=2)
+
+    print(f"\n{'size':>9}  {'batch':>5}  {'step s':>7}  {'decode s':>8}  {'total s':>7}  {'predicted':>9}")
+    for width, height in sizes:
+        for batch_size in parse_list(args.batch_sizes):
+            timer = StepTimer().start()
+            if device == "cuda":
+                torch.cuda.reset_peak_memory_stats()
+                baseline = torch.cuda.memory_allocated()
+            generate_batch(
+                pipe,
+                prompts=["elegant ceramic vase with blue patterns"] * batch_size,
+                negative_prompts=["blurry, bad quality, distorted"] * batch_size,
+                guidance_scales=[7.5] * batch_size,
+                generators=[make_generator(i)[0] for i in range(batch_size)],
+                steps=args.steps,
+                width=width,
+                height=height,
+                step_callback=timer,
+            )
+            step_seconds, decode_seconds, total_seconds = timer.finish()
+            model.observe(args.steps, width, height, batch_size, step_seconds, decode_seconds, total_seconds)
+            if device == "cuda":
+                model.observe_memory(width, height, batch_size, torch.cuda.max_memory_allocated() - baseline)
+            predicted = model.predict_seconds(args.steps, width, height, batch_size)
+            print(f"{width:>4}x{height:<4}  {batch_size:>5}  {step_seconds:>7.2f}  {decode_seconds:>8.2f}  "
+                  f"{total_seconds:>7.2f}  {predicted:>9.2f}")
+
+    model.save(args.output)
+    print(f"\n✅ Cost model: {model.state()}")
+    print(f"📄 Saved to {args.output}; set COST_MODEL_PATH to use it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Images per minute for K concurrent pipelines sharing the host's cores.
+
+Loads the pipeline once, then for every K forks K worker processes that
+share its weights, gives each cores/K intra-op threads (optionally pinned
+to those cores) and lets them generate the same number of images at the
+same time. This is how the server runs with WORKERS=K, so the best K here
+is the one to use with EXECUTION_PROFILE=throughput; K=1 is the latency
+profile.
+
+    python benchmarks/core_partitioning_benchmark.py --workers 1,2,4 --affinity
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import torch
+from diffusers import StableDiffusionPipeline
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.cpu import available_cores, configure_worker_cores, partition_cores
+from pipeline.engine import generate_batch, make_generator
+from pipeline.schedulers import create_scheduler
+
+PROMPT = "elegant ceramic vase with blue and white patterns"
+NEGATIVE_PROMPT = "blurry, bad quality, distorted"
+
+pipe = None
+
+
+def generate(seed, steps, size):
+    return generate_batch(
+        pipe,
+        prompts=[PROMPT],
+        negative_prompts=[NEGATIVE_PROMPT],
+        guidance_scales=[7.5],
+        generators=[make_generator(seed)[0]],
+        steps=steps,
+        width=size,
+        height=size,
+    )
+
+
+def worker(cores, affinity, args, barrier, results):
+    settings = configure_worker_cores(cores, affinity=affinity)
+    # Untimed, so one-off initialisation in each worker does not count
+    generate(0, 2, args.size)
+    barrier.wait()
+    latencies = []
+    for i in range(args.images):
+        start = time.perf_counter()
+        generate(i, args.steps, args.size)
+        latencies.append(time.perf_counter() - start)
+    results.put({"threads": settings["threads"], "latencies": latencies, "finished": time.time()})
+
+
+def run(num_workers, args):
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(num_workers + 1)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(cores, args.affinity, args, barrier, results))
+                 for cores in partition_cores(num_workers)]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    started = time.time()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    wall = max(report["finished"] for report in reports) - started
+    latencies = [latency for report in reports for latency in report["latencies"]]
+    return {
+        "workers": len(processes),
+        "threads_per_worker": reports[0]["threads"],
+        "images": len(latencies),
+        "wall_seconds": round(wall, 2),
+        "images_per_minute": round(60 * len(latencies) / wall, 2),
+        "mean_latency_seconds": round(sum(latencies) / len(latencies), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of K pipelines each on cores/K threads")
+    parser.add_argument("--model", type=str, default="runwayml/stable-diffusion-v1-5", help="Base model")
+    parser.add_argument("--lora_dir", type=str, default=None, help="Optional LoRA weights directory")
+    parser.add_argument("--workers", type=str, default="1,2,4", help="Comma-separated values of K")
+    parser.add_argument("--images", type=int, default=2, help="Images generated by each worker")
+    parser.add_argument("--steps", type=int, default=10, help="Denoising steps per image")
+    parser.add_argument("--size", type=int, default=512, help="Image width and height")
+    parser.add_argument("--affinity", action="store_true", help="Pin each worker to its cores")
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON report path")
+    args = parser.parse_args()
+
+    global pipe
+    # As in the server's serve_prefork: LoRA fusion and the channels_last copies are
+    # parallel torch ops, and an OpenMP pool started before the forks hangs the workers
+    torch.set_num_threads(1)
+    print("📥 Loading pipeline...")
+    pipe = StableDiffusionPipeline.from_pretrained(
+        args.model, torch_dtype=torch.float32, safety_checker=None, requires_safety_checker=False
+    )
+    if args.lora_dir:
+        pipe.load_lora_weights(args.lora_dir)
+        pipe.fuse_lora()
+        pipe.unload_lora_weights()
+    pipe.scheduler = create_scheduler("dpmpp_2m", pipe.scheduler.config)
+    pipe.unet.to(memory_format=torch.channels_last)
+    pipe.vae.to(memory_format=torch.channels_last)
+
+    cores = available_cores()
+    print(f"{len(cores)} cores, {args.images} images of {args.size}x{args.size} at {args.steps} steps per worker"
+          f"{', pinned' if args.affinity else ''}")
+    print(f"\n{'K':>3}  {'threads':>7}  {'images':>6}  {'wall s':>7}  {'img/min':>8}  {'latency s':>9}")
+    report = []
+    for num_workers in [int(k) for k in args.workers.split(",") if k.strip()]:
+        row = run(num_workers, args)
+        report.append(row)
+        print(f"{row['workers']:>3}  {row['threads_per_worker']:>7}  {row['images']:>6}  {row['wall_seconds']:>7.1f}  "
+              f"{row['images_per_minute']:>8.2f}  {row['mean_latency_seconds']:>9.1f}")
+
+    best = max(report, key=lambda row: row["images_per_minute"])
+    print(f"\n✅ Highest throughput with K={best['workers']}: set EXECUTION_PROFILE=throughput WORKERS={best['workers']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Per-step time saved by fusing the LoRA into the base weights.
+
+Runs the same generation with the LoRA layers active and then fused, and
+reports the mean time per denoising step for each.
+
+    python benchmarks/lora_fusion_benchmark.py --lora_dir ./lora-output
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+from diffusers import DPMSolverMultistepScheduler, StableDiffusionPipeline
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.engine import generate_batch, make_generator
+from pipeline.lora import FusedLora
+
+
+def time_steps(pipe, steps, width, height, batch_size, repeats):
+    """Mean seconds per denoising step, skipping the first step of each run."""
+    step_times = []
+
+    def on_step(step, timestep, latents):
+        now = time.perf_counter()
+        if step > 0:
+            step_times.append(now - on_step.last)
+        on_step.last = now
+
+    for _ in range(repeats):
+        on_step.last = time.perf_counter()
+        generate_batch(
+            pipe,
+            prompts=["elegant ceramic vase with blue patterns"] * batch_size,
+            negative_prompts=["blurry, bad quality, distorted"] * batch_size,
+            guidance_scales=[7.5] * batch_size,
+            generators=[make_generator(i)[0] for i in range(batch_size)],
+            steps=steps,
+            width=width,
+            height=height,
+            step_callback=on_step,
+        )
+    return sum(step_times) / len(step_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-step time saved by fusing the LoRA")
+    parser.add_argument("--model", type=str, default="runwayml/stable-diffusion-v1-5", help="Base model")
+    parser.add_argument("--lora_dir", type=str, default="./lora-output", help="LoRA weights directory")
+    parser.add_argument("--steps", type=int, default=10, help="Inference steps per run")
+    parser.add_argument("--width", type=int, default=512, help="Image width")
+    parser.add_argument("--height", type=int, default=512, help="Image height")
+    parser.add_argument("--batch_size", type=int, default=1, help="Images per run")
+    parser.add_argument("--repeats", type=int, default=2, help="Runs per configuration")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"📥 Loading pipeline on {device}...")
+    pipe = StableDiffusionPipeline.from_pretrained(
+        args.model,
+        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+        safety_checker=None,
+        requires_safety_checker=False
+    )
+    pipe.load_lora_weights(args.lora_dir)
+    pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+    pipe = pipe.to(device)
+
+    print("🎨 Timing unfused LoRA layers...")
+    unfused = time_steps(pipe, args.steps, args.width, args.height, args.batch_size, args.repeats)
+
+    print("⚡ Fusing LoRA...")
+    start = time.perf_counter()
+    FusedLora(pipe, args.lora_dir, scale=1.0)
+    fuse_seconds = time.perf_counter() - start
+
+    print("🎨 Timing fused weights...")
+    fused = time_steps(pipe, args.steps, args.width, args.height, args.batch_size, args.repeats)
+
+    saved = unfused - fused
+    print(f"\nUnfused: {unfused * 1000:.1f} ms/step")
+    print(f"Fused:   {fused * 1000:.1f} ms/step")
+    print(f"✅ Saved {saved * 1000:.1f} ms/step ({saved / unfused * 100:.1f}%), "
+          f"fusing took {fuse_seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Accuracy vs. speed of the int8 CPU path against fp32.
+
+Generates a fixed set of prompts and seeds with the fp32 pipeline (LoRA
+fused), quantizes it in place and generates the same set again, then
+reports per-image latency and how far the int8 images drift from fp32.
+
+    python benchmarks/quantization_benchmark.py --lora_dir ./lora-output
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from diffusers import DPMSolverMultistepScheduler, StableDiffusionPipeline
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.cost_model import module_bytes
+from pipeline.engine import generate_batch, make_generator
+from pipeline.quantization import quantize_pipeline
+
+PROMPTS = [
+    "elegant ceramic vase with blue and white patterns",
+    "rustic terracotta pot with textured surface",
+    "modern minimalist porcelain bowl",
+    "traditional Japanese raku tea cup",
+]
+SEEDS = [0, 1, 2, 3]
+NEGATIVE_PROMPT = "blurry, bad quality, distorted"
+
+
+def run(pipe, steps, width, height):
+    """Generate every prompt/seed pair one at a time, returning images and latencies."""
+    images, latencies = [], []
+    for prompt, seed in zip(PROMPTS, SEEDS):
+        start = time.perf_counter()
+        image = generate_batch(
+            pipe,
+            prompts=[prompt],
+            negative_prompts=[NEGATIVE_PROMPT],
+            guidance_scales=[7.5],
+            generators=[make_generator(seed)[0]],
+            steps=steps,
+            width=width,
+            height=height,
+        )[0]
+        latencies.append(time.perf_counter() - start)
+        images.append(np.asarray(image, dtype=np.float32))
+    return images, latencies
+
+
+def psnr(reference, image):
+    mse = float(np.mean((reference - image) ** 2))
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare int8 and fp32 CPU inference")
+    parser.add_argument("--model", type=str, default="runwayml/stable-diffusion-v1-5", help="Base model")
+    parser.add_argument("--lora_dir", type=str, default="./lora-output", help="LoRA weights directory")
+    parser.add_argument("--steps", type=int, default=20, help="Inference steps")
+    parser.add_argument("--width", type=int, default=512, help="Image width")
+    parser.add_argument("--height", type=int, default=512, help="Image height")
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON report path")
+    args = parser.parse_args()
+
+    print("📥 Loading fp32 pipeline...")
+    pipe = StableDiffusionPipeline.from_pretrained(
+        args.model,
+        torch_dtype=torch.float32,
+        safety_checker=None,
+        requires_safety_checker=False
+    )
+    pipe.load_lora_weights(args.lora_dir)
+    pipe.fuse_lora()
+    pipe.unload_lora_weights()
+    pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+    pipe = pipe.to("cpu")
+
+    print("🎨 Running fp32...")
+    fp32_images, fp32_latencies = run(pipe, args.steps, args.width, args.height)
+
+    print("⚡ Quantizing to int8...")
+    fp32_bytes = module_bytes(pipe.unet, pipe.text_encoder)
+    start = time.perf_counter()
+    quantize_pipeline(pipe)
+    quantize_seconds = time.perf_counter() - start
+    int8_bytes = module_bytes(pipe.unet, pipe.text_encoder)
+
+    print("🎨 Running int8...")
+    int8_images, int8_latencies = run(pipe, args.steps, args.width, args.height)
+
+    rows = []
+    for prompt, seed, ref, img, t32, t8 in zip(PROMPTS, SEEDS, fp32_images, int8_images,
+                                               fp32_latencies, int8_latencies):
+        rows.append({
+            "prompt": prompt,
+            "seed": seed,
+            "fp32_seconds": round(t32, 2),
+            "int8_seconds": round(t8, 2),
+            "speedup": round(t32 / t8, 2),
+            "psnr_db": round(psnr(ref, img), 2),
+            "mean_abs_diff": round(float(np.mean(np.abs(ref - img))), 2),
+        })
+
+    print(f"\n{'seed':>4}  {'fp32 s':>7}  {'int8 s':>7}  {'speedup':>7}  {'PSNR dB':>7}  prompt")
+    for row in rows:
+        print(f"{row['seed']:>4}  {row['fp32_seconds']:>7}  {row['int8_seconds']:>7}  "
+              f"{row['speedup']:>7}  {row['psnr_db']:>7}  {row['prompt']}")
+    summary = {
+        "steps": args.steps,
+        "size": f"{args.width}x{args.height}",
+        "quantize_seconds": round(quantize_seconds, 2),
+        "fp32_weights_mb": round(fp32_bytes / 2**20, 1),
+        "int8_weights_mb": round(int8_bytes / 2**20, 1),
+        "mean_speedup": round(float(np.mean([r["speedup"] for r in rows])), 2),
+        "mean_psnr_db": round(float(np.mean([r["psnr_db"] for r in rows])), 2),
+        "rows": rows,
+    }
+    print(f"\n✅ Mean speedup {summary['mean_speedup']}x, mean PSNR {summary['mean_psnr_db']} dB "
+          f"(quantization took {summary['quantize_seconds']}s)")
+    print(f"   UNet + text encoder weights: {summary['fp32_weights_mb']} MB fp32 -> "
+          f"{summary['int8_weights_mb']} MB int8")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"📄 Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
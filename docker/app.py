@@ -1,30 +1,229 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context, url_for
 from flask_cors import CORS
 import torch
-from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
+from diffusers import StableDiffusionPipeline
 from peft import LoraConfig, get_peft_model
 import base64
-import io
+import hashlib
+import json
 import os
 from PIL import Image
+import queue
+import select
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
 import uuid
+from concurrent.futures import CancelledError, as_completed, wait
+
+# pipeline/ sits next to app.py in the image and one level up in the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.admission import AdmissionController, request_cost
+from pipeline.adapters import (AdapterRegistry, UnknownAdapterError, discover_adapters,
+                               load_state_dict, parse_adapter_list)
+from pipeline.batching import BatchScheduler, GenerationCancelled, GenerationRequest
+from pipeline.cache import ResultCache, fingerprint_files
+from pipeline.cost_model import CostModel, StepTimer, module_bytes
+from pipeline.memory import MemoryPolicy, detect_memory_budget
+from pipeline.cpu import (autocast_context, available_cores, configure_worker_cores, optimize_for_cpu,
+                          partition_cores, workers_for_profile)
+from pipeline.embeddings import PromptEmbeddingCache
+from pipeline.encoding import EncoderPool, IMAGE_FORMATS, encode_image, format_for_mimetype, normalize_format
+from pipeline.engine import generate_batch, make_generator
+from pipeline.jobs import JobQueue, QueueFullError
+from pipeline.lora import FusedLora
+from pipeline.quantization import quantize_pipeline
+from pipeline.metrics import Metrics, process_rss_bytes
+from pipeline.prefork import Heartbeat, Supervisor, listen_socket, process_memory, worker_states
+from pipeline.previews import preview_callback
+from pipeline.reload import LoraWatcher, check_image
+from pipeline.schedulers import SchedulerRegistry, create_scheduler
 
 app = Flask(__name__)
-CORS(app)
+# Browsers only let scripts read non-simple response headers that are exposed
+CORS(app, expose_headers=["X-Seed", "X-Steps", "X-Guidance-Scale", "X-Width", "X-Height",
+                          "X-Scheduler", "Retry-After", "Location"])
 
 # Global pipeline variable
 pipe = None
+# Held while the pipeline runs or while its weights are being changed
+pipe_lock = threading.Lock()
+metrics = Metrics()
+in_flight = 0
+in_flight_lock = threading.Lock()
+
+# Requests arriving within BATCH_MAX_WAIT_MS of each other share one forward pass
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "4"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "50"))
+# Unfinished jobs beyond JOB_QUEUE_DEPTH are rejected with 429
+JOB_QUEUE_DEPTH = int(os.environ.get("JOB_QUEUE_DEPTH", "32"))
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", "600"))
+# Seeded results are cached in memory and, if RESULT_CACHE_DIR is set, on disk
+RESULT_CACHE_ENTRIES = int(os.environ.get("RESULT_CACHE_ENTRIES", "64"))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or None
+RESULT_CACHE_MAX_MB = float(os.environ.get("RESULT_CACHE_MAX_MB", "1024"))
+MAX_IMAGES_PER_REQUEST = int(os.environ.get("MAX_IMAGES_PER_REQUEST", "4"))
+EMBEDDING_CACHE_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_ENTRIES", "128"))
+# CPU execution mode, used when no GPU is available
+CPU_CHANNELS_LAST = os.environ.get("CPU_CHANNELS_LAST", "1") == "1"
+CPU_BF16 = os.environ.get("CPU_BF16", "auto")  # "auto", "1" or "0"
+CPU_COMPILE = os.environ.get("CPU_COMPILE", "0") == "1"
+CPU_COMPILE_CACHE_DIR = os.environ.get("CPU_COMPILE_CACHE_DIR", "/tmp/torch_compile_cache")
+CPU_THREADS = int(os.environ.get("CPU_THREADS", "0")) or None
+CPU_INTEROP_THREADS = int(os.environ.get("CPU_INTEROP_THREADS", "0")) or None
+# Merge the LoRA into the base weights instead of running LoRA layers every step
+LORA_FUSE = os.environ.get("LORA_FUSE", "1") == "1"
+LORA_SCALE = float(os.environ.get("LORA_SCALE", "1.0"))
+LORA_KEEP_PARAMS = os.environ.get("LORA_KEEP_PARAMS", "0") == "1"
+# Extra named adapters ("name=path,...") and/or a directory of adapter subdirectories.
+# When either is set, adapters are served unfused and chosen per request.
+LORA_ADAPTERS = os.environ.get("LORA_ADAPTERS", "")
+LORA_ADAPTERS_DIR = os.environ.get("LORA_ADAPTERS_DIR", "")
+MAX_RESIDENT_ADAPTERS = int(os.environ.get("MAX_RESIDENT_ADAPTERS", "3"))
+ADAPTER_GROUP_WAIT = float(os.environ.get("ADAPTER_GROUP_WAIT", "2.0"))
+# Poll the LoRA directories and swap in new weights once they are validated
+LORA_WATCH = os.environ.get("LORA_WATCH", "0") == "1"
+LORA_WATCH_INTERVAL = float(os.environ.get("LORA_WATCH_INTERVAL", "10"))
+LORA_WATCH_SETTLE = float(os.environ.get("LORA_WATCH_SETTLE", "5"))
+LORA_VALIDATION_STEPS = int(os.environ.get("LORA_VALIDATION_STEPS", "2"))
+# Schedulers requests may choose from, and the one used when they do not
+SCHEDULERS = os.environ.get("SCHEDULERS", "dpmpp_2m,euler,unipc,ddim")
+DEFAULT_SCHEDULER = os.environ.get("DEFAULT_SCHEDULER", "dpmpp_2m")
+# An LCM LoRA enables the "lcm" scheduler for 4-8 step generations
+LCM_LORA_DIR = os.environ.get("LCM_LORA_DIR", "")
+# Streamed previews are decoded from latents with a linear map, not the VAE
+PREVIEW_UPSCALE = int(os.environ.get("PREVIEW_UPSCALE", "4"))
+PREVIEW_QUALITY = int(os.environ.get("PREVIEW_QUALITY", "70"))
+# Result images are encoded on a pool so request threads never compress them
+ENCODE_WORKERS = int(os.environ.get("ENCODE_WORKERS", "2"))
+# zlib level for PNG: 1 is several times faster than Pillow's default 6 and slightly larger
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "1"))
+# Default quality for WebP/JPEG when a request sets none, and WebP encoder effort (0-6)
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "90"))
+WEBP_METHOD = int(os.environ.get("WEBP_METHOD", "4"))
+# Default per-request deadline in seconds (0 for none); requests may set "timeout"
+GENERATION_TIMEOUT = float(os.environ.get("GENERATION_TIMEOUT", "0"))
+# How often a waiting request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = float(os.environ.get("DISCONNECT_POLL_INTERVAL", "0.5"))
+# Requests are weighed in cost units: one denoising step of one 512x512 image
+MAX_WIDTH = int(os.environ.get("MAX_WIDTH", "1024"))
+MAX_HEIGHT = int(os.environ.get("MAX_HEIGHT", "1024"))
+MAX_STEPS = int(os.environ.get("MAX_STEPS", "50"))
+MAX_INFLIGHT_COST = float(os.environ.get("MAX_INFLIGHT_COST", "1000"))
+# Token bucket per bearer token (or client address); 0 disables it
+CLIENT_BUDGET = float(os.environ.get("CLIENT_BUDGET", "0"))
+CLIENT_BUDGET_REFILL = float(os.environ.get("CLIENT_BUDGET_REFILL", "1.0"))
+# Calibrated latency/memory model, refined by every batch and saved after warmup
+COST_MODEL_PATH = os.environ.get("COST_MODEL_PATH", "/tmp/cost_model.json")
+# Peak memory a batch may use before VAE slicing/tiling and attention slicing
+# kick in; "auto" derives it from the device, 0 disables the policy
+MEMORY_BUDGET_MB = os.environ.get("MEMORY_BUDGET_MB", "auto")
+# Bearer token for /api/admin endpoints; admin endpoints are disabled when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+# int8 dynamic quantization of the UNet and text encoder (CPU only)
+QUANTIZE_INT8 = os.environ.get("QUANTIZE_INT8", "0") == "1"
+QUANTIZE_CACHE_DIR = os.environ.get("QUANTIZE_CACHE_DIR", "/tmp/quantized_cache")
+# Short generations run at startup so the first request sees steady-state latency
+WARMUP_RESOLUTIONS = os.environ.get("WARMUP_RESOLUTIONS", "512x512")
+WARMUP_BATCH_SIZES = os.environ.get("WARMUP_BATCH_SIZES", "1")
+WARMUP_STEPS = int(os.environ.get("WARMUP_STEPS", "2"))
+LORA_DIR = os.environ.get("LORA_DIR", "./lora-output")
+PORT = int(os.environ.get("PORT", "7860"))
+# "latency": one worker using every core; "throughput": one worker per few
+# cores, each with its own share of the cores, for more images per minute
+EXECUTION_PROFILE = os.environ.get("EXECUTION_PROFILE", "latency")
+# Worker processes forked after the pipeline is loaded, sharing its weights (CPU only);
+# "auto" follows EXECUTION_PROFILE. Each worker gets cores/WORKERS intra-op threads.
+WORKERS = (int(os.environ["WORKERS"]) if os.environ.get("WORKERS", "auto") != "auto"
+           else workers_for_profile(EXECUTION_PROFILE, len(available_cores())))
+# Pin every worker to its share of the cores
+CPU_AFFINITY = os.environ.get("CPU_AFFINITY", "0") == "1"
+WORKER_STATUS_DIR = os.environ.get("WORKER_STATUS_DIR", "/tmp/pottery_workers")
+WORKER_HEARTBEAT_TIMEOUT = float(os.environ.get("WORKER_HEARTBEAT_TIMEOUT", "120"))
+# Worker i also listens on 127.0.0.1:WORKER_PORT_BASE+i so others can forward job lookups
+WORKER_PORT_BASE = int(os.environ.get("WORKER_PORT_BASE", "7870"))
+MODEL_ID = "runwayml/stable-diffusion-v1-5"
+DEFAULT_NEGATIVE_PROMPT = 'blurry, bad quality, distorted'
+
+cost_model = CostModel()
+memory_policy = None
+admission = AdmissionController(MAX_INFLIGHT_COST, CLIENT_BUDGET, CLIENT_BUDGET_REFILL)
+batcher = None
+jobs = None
+result_cache = None
+embedding_cache = None
+engine_settings = {}
+worker_index = None
+encoder = None
+lora_fusion = None
+base_fingerprint = None
+adapters = None
+scheduler_registry = None
+lora_watcher = None
+last_reload = None
+
+# Model loading progress, read by the readiness endpoints
+loading_lock = threading.Lock()
+loading = {
+    "phase": "starting",
+    "ready": False,
+    "error": None,
+    "started_at": time.time(),
+    "phases": {},
+    "warmup": [],
+}
+
+def set_phase(phase):
+    """Record the start of a loading phase and how long the previous one took."""
+    with loading_lock:
+        now = time.time()
+        previous = loading["phase"]
+        loading["phases"][previous] = round(now - loading.get("phase_started_at", loading["started_at"]), 2)
+        loading["phase"] = phase
+        loading["phase_started_at"] = now
+        loading["ready"] = phase == "ready"
+    print(f"Loading phase: {phase}")
+
+def loading_status():
+    with loading_lock:
+        return {
+            "phase": loading["phase"],
+            "ready": loading["ready"],
+            "error": loading["error"],
+            "phases": dict(loading["phases"]),
+            "warmup": list(loading["warmup"]),
+            "elapsed_seconds": round(time.time() - loading["started_at"], 1),
+        }
+
+def is_ready():
+    with loading_lock:
+        return loading["ready"]
 
 def load_model():
+    load_pipeline()
+    start_engine()
+
+def load_pipeline(workers=1):
+    """
+    Load and optimize the weights; runs no inference, so it can precede a fork.
+
+    With ``workers`` > 1 the caller forks that many processes afterwards:
+    torch stays at its current thread count (see serve_prefork) and the
+    automatic memory budget is split between the workers.
+    """
     global pipe
     
     # Load base Stable Diffusion model
-    model_id = "runwayml/stable-diffusion-v1-5"  # or your base model
+    model_id = MODEL_ID  # or your base model
     
     # Use CPU-compatible settings for Hugging Face Spaces
     device = "cuda" if torch.cuda.is_available() else "cpu"
     torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
     
+    set_phase("base_weights")
     pipe = StableDiffusionPipeline.from_pretrained(
         model_id,
         torch_dtype=torch_dtype,
@@ -32,86 +231,782 @@ def load_model():
         requires_safety_checker=False
     )
     
-    # Load your LoRA weights - update path to match your structure
-    pipe.load_lora_weights("./lora-output")  # Path to your LoRA files
+    global base_fingerprint, lora_fusion, adapters
+    base_fingerprint = f"{model_id}:{fingerprint_files(LORA_DIR)}"
+    quantize = QUANTIZE_INT8 and device == "cpu"
+    
+    adapter_sources = {"default": LORA_DIR}
+    adapter_sources.update(discover_adapters(LORA_ADAPTERS_DIR))
+    adapter_sources.update(parse_adapter_list(LORA_ADAPTERS))
+    if LCM_LORA_DIR:
+        # Stacked on top of the selected adapter, so it needs unfused adapters too
+        adapter_sources["lcm"] = LCM_LORA_DIR
+    use_registry = len(adapter_sources) > 1
+    if use_registry and quantize:
+        print("Per-request adapters need unfused LoRA layers; serving only the default adapter with int8")
+        use_registry = False
+    if quantize:
+        base_fingerprint += ":int8"
+    quantized_path = os.path.join(
+        QUANTIZE_CACHE_DIR, f"{base_fingerprint}:{LORA_SCALE}".replace("/", "_").replace(":", "_") + ".pt"
+    )
+    
+    if quantize and os.path.exists(quantized_path):
+        # The cached int8 weights already contain the fused LoRA
+        set_phase("quantize")
+        quantize_pipeline(pipe, quantized_path)
+    elif not use_registry:
+        set_phase("lora")
+        # Load your LoRA weights - update path to match your structure
+        pipe.load_lora_weights(LORA_DIR)  # Path to your LoRA files
+        
+        if quantize:
+            set_phase("quantize")
+            # Quantize the merged weights, not the base weights beside LoRA layers
+            pipe.fuse_lora(lora_scale=LORA_SCALE)
+            pipe.unload_lora_weights()
+            quantize_pipeline(pipe, quantized_path)
     
-    # Use DPM solver for faster generation
-    pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+    set_phase("scheduler")
+    global scheduler_registry
+    scheduler_names = [DEFAULT_SCHEDULER] + [name for name in SCHEDULERS.split(",") if name.strip()]
+    if use_registry and LCM_LORA_DIR:
+        scheduler_names.append("lcm")
+    # Every request gets its own scheduler instance; pipe.scheduler only serves warmup
+    scheduler_registry = SchedulerRegistry(pipe.scheduler.config, scheduler_names)
+    pipe.scheduler = create_scheduler(DEFAULT_SCHEDULER, pipe.scheduler.config)
     
     # Move to appropriate device
     pipe = pipe.to(device)
     print(f"Using {device} for inference")
     
+    if use_registry:
+        # Adapters are loaded on first use and stay unfused so they can be switched per batch
+        adapters = AdapterRegistry(pipe, adapter_sources, max_resident=MAX_RESIDENT_ADAPTERS)
+    elif LORA_FUSE and not quantize:
+        set_phase("fuse_lora")
+        lora_fusion = FusedLora(pipe, LORA_DIR, scale=LORA_SCALE, keep_lora=LORA_KEEP_PARAMS)
+    elif not quantize:
+        # Unfused layers run at their adapter weight, which load_lora_weights leaves at 1.0
+        pipe.set_adapters(pipe.get_active_adapters(), adapter_weights=[LORA_SCALE])
+    
+    global engine_settings
     if device == "cuda":
-        pipe.enable_memory_efficient_attention()
+        engine_settings = {"mode": "cuda", "dtype": "float16", "attention": "sdpa"}
+        if not hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+            # Older torch: fall back to xformers kernels when they are installed
+            try:
+                pipe.enable_xformers_memory_efficient_attention()
+                engine_settings["attention"] = "xformers"
+            except Exception as e:
+                print(f"xformers attention unavailable: {e}")
+                engine_settings["attention"] = "default"
+    else:
+        bf16 = CPU_BF16 if CPU_BF16 == "auto" else CPU_BF16 == "1"
+        engine_settings = optimize_for_cpu(
+            pipe,
+            channels_last=CPU_CHANNELS_LAST,
+            # int8 dynamic kernels take fp32 activations
+            bf16=False if quantize else bf16,
+            compile=CPU_COMPILE,
+            compile_cache_dir=CPU_COMPILE_CACHE_DIR,
+            # Forked workers set their own count in configure_worker_cores
+            intra_op_threads=CPU_THREADS if workers == 1 else None,
+            inter_op_threads=CPU_INTEROP_THREADS
+        )
+        engine_settings["int8"] = quantize
+    print(f"Engine settings: {engine_settings}")
+
+    global cost_model
+    low_precision = device == "cuda" or engine_settings.get("bf16", False)
+    cost_model = CostModel(
+        weights_bytes=module_bytes(pipe.unet, pipe.vae, pipe.text_encoder),
+        dtype_bytes=2 if low_precision else 4,
+        # diffusers uses memory-efficient SDPA attention when torch provides it
+        quadratic_attention=not hasattr(torch.nn.functional, "scaled_dot_product_attention"),
+    )
+    if cost_model.load(COST_MODEL_PATH):
+        print(f"Loaded cost model from {COST_MODEL_PATH}")
+    
+    global memory_policy
+    if MEMORY_BUDGET_MB == "auto":
+        budget = detect_memory_budget(device)
+        if budget and workers > 1:
+            # Weights are shared copy-on-write; each worker gets its share of the rest
+            weights = cost_model.weights_bytes
+            budget = weights + max(0, budget - weights) // workers
+    else:
+        budget = int(float(MEMORY_BUDGET_MB) * 1024 * 1024) or None
+    if budget:
+        # Attention slicing swaps attention processors, which would undo torch.compile
+        memory_policy = MemoryPolicy(pipe, cost_model, budget,
+                                     allow_attention_slicing=not engine_settings.get("compiled", False))
+        print(f"Memory budget: {budget / 2**30:.1f} GiB")
+
+def start_engine():
+    """Start batching and job handling on the loaded pipeline, then warm it up."""
+    global batcher, jobs, result_cache, embedding_cache, encoder
+    encoder = EncoderPool(ENCODE_WORKERS, compress_level=PNG_COMPRESS_LEVEL, quality=IMAGE_QUALITY,
+                          webp_method=WEBP_METHOD, on_encoded=metrics.observe_stage)
+    weights_fingerprint = current_fingerprint()
+    
+    # The default negative prompt is shared by nearly every request
+    embedding_cache = PromptEmbeddingCache(pipe, max_entries=EMBEDDING_CACHE_ENTRIES,
+                                           fingerprint=weights_fingerprint)
+    embedding_cache.precompute(DEFAULT_NEGATIVE_PROMPT)
+    
+    if adapters is not None:
+        # After precompute, so pinned embeddings come from the plain text encoder
+        set_phase("lora")
+        adapters.activate("default", LORA_SCALE)
+    
+    result_cache = ResultCache(
+        weights_fingerprint,
+        max_entries=RESULT_CACHE_ENTRIES,
+        disk_dir=RESULT_CACHE_DIR,
+        disk_max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024)
+    )
+    batcher = BatchScheduler(run_batch, max_batch_size=BATCH_MAX_SIZE,
+                             max_wait=BATCH_MAX_WAIT_MS / 1000.0,
+                             max_group_wait=ADAPTER_GROUP_WAIT,
+                             on_cancel=record_cancelled).start()
+    jobs = JobQueue(batcher, max_depth=JOB_QUEUE_DEPTH, result_ttl=JOB_RESULT_TTL,
+                    cache=result_cache, admission=admission, cost_fn=generation_cost,
+                    estimate_fn=cost_model.predict_seconds,
+                    id_prefix=f"w{worker_index}-" if worker_index is not None else "",
+                    on_coalesced=record_coalesced, encoder=encoder)
+    register_metrics()
+    
+    set_phase("warmup")
+    warmup()
+    set_phase("ready")
+    
+    global lora_watcher
+    if LORA_WATCH and (adapters is not None or lora_fusion is not None):
+        lora_watcher = LoraWatcher(lora_paths, reload_lora, interval=LORA_WATCH_INTERVAL,
+                                   settle=LORA_WATCH_SETTLE).start()
+
+def parse_warmup_shapes():
+    """Parse WARMUP_RESOLUTIONS ("512x512,768x768") and WARMUP_BATCH_SIZES ("1,4")."""
+    resolutions = []
+    for item in WARMUP_RESOLUTIONS.split(","):
+        if item.strip():
+            width, height = item.lower().split("x")
+            resolutions.append((int(width), int(height)))
+    batch_sizes = [int(item) for item in WARMUP_BATCH_SIZES.split(",") if item.strip()]
+    return [(w, h, b) for w, h in resolutions for b in batch_sizes]
+
+def warmup():
+    """Run a short generation for every configured shape and record its timing."""
+    if WARMUP_STEPS <= 0:
+        return
+    for width, height, batch_size in parse_warmup_shapes():
+        start = time.perf_counter()
+        kwargs = dict(
+            prompts=["a ceramic vase"] * batch_size,
+            negative_prompts=[DEFAULT_NEGATIVE_PROMPT] * batch_size,
+            guidance_scales=[7.5] * batch_size,
+            generators=[make_generator(i)[0] for i in range(batch_size)],
+            steps=WARMUP_STEPS,
+            width=width,
+            height=height,
+            embedding_cache=embedding_cache,
+        )
+        # Bypasses the batcher and metrics so warmup does not skew request stats,
+        # but its timings calibrate the cost model
+        with pipe_lock, autocast_context(pipe.device.type, engine_settings.get("bf16", False)):
+            if memory_policy is not None:
+                kwargs["memory_options"] = memory_policy.plan(width, height, batch_size) or {}
+                memory_policy.apply(kwargs["memory_options"])
+            generate_and_observe(**kwargs)
+        seconds = round(time.perf_counter() - start, 2)
+        print(f"Warmup {width}x{height} batch {batch_size}: {seconds}s")
+        with loading_lock:
+            loading["warmup"].append({
+                "width": width,
+                "height": height,
+                "batch_size": batch_size,
+                "steps": WARMUP_STEPS,
+                "seconds": seconds,
+            })
+    try:
+        cost_model.save(COST_MODEL_PATH)
+    except OSError as e:
+        print(f"Could not save cost model to {COST_MODEL_PATH}: {e}")
+
+def current_fingerprint():
+    """Identify the weights being served, including the fused LoRA scale."""
+    if adapters is not None:
+        # Adapter and scale are part of each request's cache key instead
+        return f"{base_fingerprint}:adapters"
+    scale = lora_fusion.scale if lora_fusion is not None else LORA_SCALE
+    return f"{base_fingerprint}:scale={scale}"
+
+def lora_paths():
+    """Directories the served LoRA weights come from, by adapter name."""
+    if adapters is not None:
+        return adapters.paths()
+    return {"default": lora_fusion.lora_dir}
+
+def validate_weights():
+    """Short generation with the weights being swapped in; raises if the image is unusable."""
+    width, height, _ = (parse_warmup_shapes() or [(512, 512, 1)])[0]
+    with autocast_context(pipe.device.type, engine_settings.get("bf16", False)):
+        image = generate_batch(
+            pipe,
+            prompts=["a ceramic vase"],
+            negative_prompts=[DEFAULT_NEGATIVE_PROMPT],
+            guidance_scales=[7.5],
+            generators=[make_generator(0)[0]],
+            steps=LORA_VALIDATION_STEPS,
+            width=width,
+            height=height,
+        )[0]
+    check_image(image)
+
+def reload_lora(name="default", path=None):
+    """Load new weights for an adapter from disk and swap them in without a restart."""
+    global base_fingerprint, last_reload
+    if adapters is None and lora_fusion is None:
+        raise RuntimeError("Hot reload needs LORA_FUSE=1 or per-request adapters; int8 weights need a restart")
+    if adapters is None and name != "default":
+        raise UnknownAdapterError(name)
+    if adapters is not None and not adapters.has(name):
+        raise UnknownAdapterError(name)
+    path = path or lora_paths()[name]
+    
+    # Reading the weights is the slow part and does not need the pipeline
+    state_dict = load_state_dict(path)
+    fingerprint = fingerprint_files(path)
+    start = time.perf_counter()
+    try:
+        # Traffic pauses only for the validation generation and the swap
+        with pipe_lock:
+            if adapters is not None:
+                adapters.replace(name, state_dict, fingerprint, validate_weights, scale=LORA_SCALE, path=path)
+            else:
+                lora_fusion.replace(state_dict, validate_weights, fingerprint, lora_dir=path)
+                base_fingerprint = f"{MODEL_ID}:{fingerprint}"
+                weights_fingerprint = current_fingerprint()
+                result_cache.fingerprint = weights_fingerprint
+                embedding_cache.bind(pipe, weights_fingerprint)
+                embedding_cache.precompute(DEFAULT_NEGATIVE_PROMPT)
+    except Exception as e:
+        metrics.inc("lora_reloads_total", help_text="LoRA hot reloads", result="failed")
+        last_reload = {"adapter": name, "path": path, "ok": False, "error": str(e), "at": time.time()}
+        raise
+    
+    seconds = round(time.perf_counter() - start, 2)
+    metrics.inc("lora_reloads_total", help_text="LoRA hot reloads", result="ok")
+    last_reload = {"adapter": name, "path": path, "ok": True, "fingerprint": fingerprint,
+                   "seconds": seconds, "at": time.time()}
+    print(f"Reloaded LoRA '{name}' from {path} in {seconds}s")
+    return last_reload
+
+def load_model_in_background(load=load_model):
+    """Load the model on a background thread so the server can bind immediately."""
+    def target():
+        try:
+            load()
+            print("Model loaded successfully!")
+        except Exception as e:
+            print(f"Model loading failed: {e}")
+            with loading_lock:
+                loading["error"] = str(e)
+            set_phase("failed")
+    
+    thread = threading.Thread(target=target, name="model-loader", daemon=True)
+    thread.start()
+    return thread
+
+def register_metrics():
+    """Gauges that are computed when /metrics is scraped."""
+    def cache_stats(field):
+        return lambda: {
+            (("cache", "result"),): result_cache.stats()[field],
+            (("cache", "embedding"),): embedding_cache.stats()[field],
+        }
+    
+    metrics.gauge_fn("queue_depth", jobs.depth, "Unfinished jobs, queued or running")
+    metrics.gauge_fn("batcher_pending", batcher.queue_depth, "Requests waiting to be batched")
+    metrics.gauge_fn("in_flight_requests", lambda: in_flight, "Generation requests being served")
+    metrics.gauge_fn("cache_hits", cache_stats("hits"), "Cache hits since start")
+    metrics.gauge_fn("cache_misses", cache_stats("misses"), "Cache misses since start")
+    metrics.gauge_fn("cache_hit_ratio", lambda: {
+        (("cache", "result"),): hit_ratio(result_cache.stats()),
+        (("cache", "embedding"),): hit_ratio(embedding_cache.stats()),
+    }, "Fraction of lookups served from cache")
+    metrics.gauge_fn("process_resident_memory_bytes", process_rss_bytes, "Resident set size")
+    metrics.gauge_fn("admission_inflight_cost", lambda: admission.stats()["inflight_cost"],
+                     "Cost units of admitted, unfinished generations")
+    metrics.gauge_fn("admission_rejected", lambda: admission.stats()["rejected"],
+                     "Generations rejected by cost-based admission since start")
+    if adapters is not None:
+        metrics.gauge_fn("adapter_loads", lambda: adapters.state()["loads"], "LoRA adapters loaded since start")
+        metrics.gauge_fn("adapter_evictions", lambda: adapters.state()["evictions"], "LoRA adapters evicted since start")
+
+def hit_ratio(stats):
+    lookups = stats["hits"] + stats["misses"]
+    return round(stats["hits"] / lookups, 4) if lookups else 0.0
+
+def step_callback(requests):
+    """Per-step hook: send previews and stop once every request in the batch is cancelled."""
+    previews = preview_callback(requests, requests[0].steps, metrics, PREVIEW_UPSCALE)
+    
+    def on_step(step, timestep, latents):
+        if previews is not None:
+            previews(step, timestep, latents)
+        live = False
+        for r in requests:
+            if r.cancel_reason() is None:
+                r.steps_done = step + 1
+                live = True
+        if not live:
+            raise GenerationCancelled()
+    
+    return on_step
+
+def record_coalesced(count):
+    metrics.inc("requests_coalesced_total", count,
+                help_text="Requests that attached to an identical in-flight generation instead of running")
+
+def record_cancelled(gen_request, reason):
+    stage = "queued" if gen_request.started_at is None else "running"
+    metrics.inc("generations_cancelled_total", help_text="Generations cancelled before finishing",
+                reason=reason, stage=stage)
+    metrics.inc("cancelled_steps_total", gen_request.steps_done,
+                help_text="Denoising steps spent on generations that were then cancelled")
+
+def run_batch(requests):
+    """Run a list of compatible GenerationRequests through the pipeline."""
+    first = requests[0]
+    for r in requests:
+        metrics.observe_stage("queue_wait", r.started_at - r.submitted_at)
+    metrics.inc("images_generated_total", len(requests), "Images generated by the pipeline")
+    metrics.observe("batch_size", len(requests), "Requests per batched forward pass",
+                    buckets=tuple(range(1, BATCH_MAX_SIZE + 1)))
+    generators = []
+    for r in requests:
+        # Unseeded requests report the seed that was drawn for them
+        generator, r.seed = make_generator(r.seed)
+        generators.append(generator)
+    kwargs = dict(
+        prompts=[r.prompt for r in requests],
+        negative_prompts=[r.negative_prompt for r in requests],
+        guidance_scales=[r.guidance_scale for r in requests],
+        generators=generators,
+        steps=first.steps,
+        width=first.width,
+        height=first.height,
+        embedding_cache=embedding_cache,
+        metrics=metrics,
+    )
+    with pipe_lock:
+        if adapters is not None:
+            # Batches never mix adapters, so one switch serves the whole batch
+            lcm = first.scheduler == "lcm"
+            adapters.activate(first.adapter, first.lora_scale, extra=[("lcm", 1.0)] if lcm else ())
+            if adapters.affects_text_encoder(first.adapter) or (lcm and adapters.affects_text_encoder("lcm")):
+                kwargs["embedding_fingerprint"] = (
+                    f"{current_fingerprint()}:{first.adapter}:{first.adapter_fingerprint}:{first.lora_scale}"
+                    + (":lcm" if lcm else "")
+                )
+        chunk_size = len(requests)
+        if memory_policy is not None:
+            # Batches too large for the budget even with every option run in smaller pieces
+            chunk_size = memory_policy.max_batch_size(first.width, first.height, len(requests))
+        images = []
+        cancelled = 0
+        for start in range(0, len(requests), chunk_size):
+            chunk = requests[start:start + chunk_size]
+            chunk_kwargs = dict(kwargs)
+            for key in ("prompts", "negative_prompts", "guidance_scales", "generators"):
+                chunk_kwargs[key] = kwargs[key][start:start + chunk_size]
+            if memory_policy is not None:
+                chunk_kwargs["memory_options"] = memory_policy.plan(first.width, first.height, len(chunk)) or {}
+                memory_policy.apply(chunk_kwargs["memory_options"])
+            chunk_kwargs["scheduler"] = scheduler_registry.get(first.scheduler, first.steps, pipe.device)
+            chunk_kwargs["step_callback"] = step_callback(chunk)
+            try:
+                # Generate images with device-appropriate autocast
+                with metrics.time("batch"), autocast_context(pipe.device.type, engine_settings.get("bf16", False)):
+                    images.extend(generate_and_observe(**chunk_kwargs))
+            except GenerationCancelled:
+                cancelled += len(chunk)
+                for r in chunk:
+                    r.cancel(r.cancel_reason() or "cancelled")
+                images.extend([None] * len(chunk))
+        if cancelled == len(requests):
+            raise GenerationCancelled()
+        return images
+
+def generate_and_observe(memory_options=None, **kwargs):
+    """Run generate_batch and feed its stage timings (and CUDA peak memory) to the cost model."""
+    timer = StepTimer().start()
+    callback = kwargs.get("step_callback")
+    
+    def on_step(step, timestep, latents):
+        timer(step, timestep, latents)
+        if callback is not None:
+            callback(step, timestep, latents)
+    
+    kwargs["step_callback"] = on_step
+    shape = (kwargs["width"], kwargs["height"], len(kwargs["prompts"]))
+    cuda = pipe.device.type == "cuda"
+    if cuda:
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+    images = generate_batch(pipe, **kwargs)
+    timings = timer.finish()
+    if timings is not None:
+        cost_model.observe(kwargs["steps"], *shape, *timings)
+    if cuda:
+        cost_model.observe_memory(*shape, torch.cuda.max_memory_allocated() - baseline,
+                                  **(memory_options or {}))
+    return images
+
+def generation_cost(gen_request):
+    return request_cost(gen_request.steps, gen_request.width, gen_request.height)
+
+def client_key():
+    """Who pays for a request: its bearer token if it has one, else its address."""
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        # Hashed so tokens never sit in memory or logs in the clear
+        return "token:" + hashlib.sha256(auth[7:].encode()).hexdigest()[:16]
+    return f"addr:{request.remote_addr}"
+
+def parse_generation_request(data, prompt=None, check_cost=True):
+    """Build a GenerationRequest from a JSON body."""
+    gen_request = GenerationRequest(
+        prompt=data.get('prompt', '') if prompt is None else prompt,
+        negative_prompt=data.get('negative_prompt', DEFAULT_NEGATIVE_PROMPT),
+        guidance_scale=data.get('guidance_scale', 7.5),
+        seed=data.get('seed', None),
+        steps=data.get('steps', 20),
+        width=data.get('width', 512),
+        height=data.get('height', 512),
+        scheduler=scheduler_registry.normalize(data.get('scheduler') or DEFAULT_SCHEDULER),
+    )
+    if not 1 <= gen_request.steps <= MAX_STEPS:
+        raise ValueError(f"steps must be between 1 and {MAX_STEPS}")
+    for name, value, limit in (("width", gen_request.width, MAX_WIDTH), ("height", gen_request.height, MAX_HEIGHT)):
+        if not 64 <= value <= limit or value % 8:
+            raise ValueError(f"{name} must be a multiple of 8 between 64 and {limit}")
+    if check_cost:
+        admission.check_request(generation_cost(gen_request))
+        if memory_policy is not None:
+            memory_policy.check(gen_request.width, gen_request.height)
+    
+    timeout = data.get('timeout') or GENERATION_TIMEOUT
+    if timeout:
+        if float(timeout) <= 0:
+            raise ValueError("timeout must be a positive number of seconds")
+        gen_request.deadline = gen_request.submitted_at + float(timeout)
+    
+    adapter = data.get('adapter')
+    lora_scale = data.get('lora_scale')
+    if adapters is not None:
+        adapter = adapter or "default"
+        if not adapters.has(adapter):
+            raise ValueError(f"Unknown adapter: {adapter}")
+        gen_request.adapter = adapter
+        gen_request.lora_scale = LORA_SCALE if lora_scale is None else float(lora_scale)
+        gen_request.adapter_fingerprint = adapters.fingerprint(adapter)
+    elif adapter not in (None, "default") or lora_scale is not None:
+        raise ValueError("Per-request adapter and lora_scale need LORA_ADAPTERS or LORA_ADAPTERS_DIR")
+    return gen_request
+
+def parse_generation_requests(data, check_cost=True):
+    """
+    Build one GenerationRequest per image for a body that may ask for
+    several variants via ``num_images`` and/or an explicit ``seeds`` list.
+    """
+    seeds = data.get('seeds')
+    num_images = int(data.get('num_images', len(seeds) if seeds else 1))
+    if num_images < 1 or num_images > MAX_IMAGES_PER_REQUEST:
+        raise ValueError(f"num_images must be between 1 and {MAX_IMAGES_PER_REQUEST}")
+    
+    if seeds is None:
+        seed = data.get('seed', None)
+        # A single seed is expanded to consecutive seeds, one per image
+        seeds = [None if seed is None else int(seed) + i for i in range(num_images)]
+    elif len(seeds) != num_images:
+        raise ValueError("seeds must have one entry per image")
+    
+    requests = []
+    for seed in seeds:
+        gen_request = parse_generation_request(data, check_cost=check_cost)
+        gen_request.seed = None if seed is None else int(seed)
+        requests.append(gen_request)
+    
+    if check_cost:
+        admission.check_request(sum(generation_cost(r) for r in requests))
+    
+    preview_every = int(data.get('preview_every', 0))
+    if preview_every < 0:
+        raise ValueError("preview_every must be 0 or a positive number of steps")
+    for gen_request in requests:
+        gen_request.preview_every = preview_every
+    return requests
+
+def client_disconnected():
+    """True if the client of the current request has closed its connection."""
+    sock = request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # A closed connection is readable and returns no data
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+def wait_for_jobs(submitted):
+    """Block until every job is finished, cancelling them all if the client goes away."""
+    futures = [job.future for job in submitted]
+    while True:
+        _, not_done = wait(futures, timeout=DISCONNECT_POLL_INTERVAL)
+        if not not_done:
+            return
+        if client_disconnected():
+            for job in submitted:
+                jobs.cancel(job, "disconnected")
+            raise GenerationCancelled("disconnected")
+
+def cancelled_response(e):
+    status = 504 if getattr(e, 'reason', None) == "deadline" else 409
+    return jsonify({"error": str(e) or "Generation cancelled"}), status
+
+def encode_data_uri(future):
+    """Future of the base64 PNG data URI of a generation, encoded on the pool as soon as it finishes."""
+    return encoder.submit_when_done(future, 'png', as_data_uri=True)
+
+def preview_to_data_uri(image):
+    """Encode a preview as a small JPEG data URI."""
+    buffer, mimetype, _ = encode_image(image, 'jpeg', PREVIEW_QUALITY)
+    return f"data:{mimetype};base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+def negotiate_format(data, default=None):
+    """
+    Pick the binary image format from the body's format field or the Accept
+    header. Returns None when the client wants the JSON response.
+    """
+    requested = data.get('format')
+    if requested is not None:
+        if requested == 'json':
+            return None
+        fmt = normalize_format(requested)
+        if fmt is None:
+            raise ValueError(f"Unsupported format: {requested}")
+        return fmt
+    
+    offered = ['application/json'] + sorted({mimetype for _, mimetype, _ in IMAGE_FORMATS.values()})
+    if default is not None:
+        offered.insert(0, IMAGE_FORMATS[default][1])
+    best = request.accept_mimetypes.best_match(offered)
+    if best is None or best == 'application/json':
+        return default
+    return format_for_mimetype(best)
+
+def image_response(image, gen_request, fmt, quality=None, as_attachment=False):
+    """Send raw image bytes with the generation metadata in headers."""
+    buffer, mimetype, extension = encoder.encode(image, fmt, quality)
+    response = send_file(
+        buffer,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=f"generated_{uuid.uuid4()}.{extension}"
+    )
+    if gen_request.seed is not None:
+        response.headers["X-Seed"] = str(gen_request.seed)
+    response.headers["X-Steps"] = str(gen_request.steps)
+    response.headers["X-Guidance-Scale"] = str(gen_request.guidance_scale)
+    response.headers["X-Width"] = str(gen_request.width)
+    response.headers["X-Height"] = str(gen_request.height)
+    response.headers["X-Scheduler"] = gen_request.scheduler
+    return response
+
+def queue_full_response(e):
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
+# Endpoints that hold the connection while an image is generated
+GENERATION_ENDPOINTS = {'generate_image', 'generate_image_file', 'batch_generate'}
+
+# Endpoints that need the model (or the job queue) and answer 503 until it is ready
+MODEL_ENDPOINTS = GENERATION_ENDPOINTS | {'create_job', 'estimate', 'get_job', 'cancel_job', 'get_job_result'}
+
+@app.before_request
+def require_ready_model():
+    if request.endpoint in MODEL_ENDPOINTS and not is_ready():
+        status = loading_status()
+        response = jsonify({"error": "Model is not ready", "loading": status})
+        response.headers["Retry-After"] = "10"
+        return response, 503
+
+@app.before_request
+def track_request_start():
+    global in_flight
+    if request.endpoint in GENERATION_ENDPOINTS:
+        with in_flight_lock:
+            in_flight += 1
+        g.in_flight = True
+
+@app.teardown_request
+def track_request_end(exc):
+    global in_flight
+    # Only undo what track_request_start counted; earlier hooks may short-circuit
+    if g.pop('in_flight', False):
+        with in_flight_lock:
+            in_flight -= 1
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/live', methods=['GET'])
+def liveness_check():
+    # The process is serving requests, whether or not the model is loaded
+    return jsonify({"status": "alive"})
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    status = loading_status()
+    return jsonify(status), 200 if status["ready"] else 503
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    status = loading_status()
+    if status["ready"]:
+        state = "healthy"
+    else:
+        state = "failed" if status["phase"] == "failed" else "loading"
     return jsonify({
-        "status": "healthy", 
-        "model_loaded": pipe is not None,
-        "device": "cuda" if torch.cuda.is_available() else "cpu"
+        "status": state,
+        "model_loaded": status["ready"],
+        "loading": status,
+        "engine": engine_settings,
+        "worker": {"index": worker_index, "pid": os.getpid()} if worker_index is not None else None,
+        "lora": lora_fusion.state() if lora_fusion is not None else {"fused": False, "scale": LORA_SCALE},
+        "adapters": adapters.state() if adapters is not None else None,
+        "admission": admission.stats(),
+        "cost_model": cost_model.state(),
+        "encoder": encoder.state() if encoder is not None else None,
+        "memory": memory_policy.state() if memory_policy is not None else None,
+        "lora_reload": {"watching": lora_watcher is not None, "last": last_reload},
+        "schedulers": scheduler_registry.stats() if scheduler_registry is not None else None,
+        "device": "cuda" if torch.cuda.is_available() else "cpu",
+        "queue_depth": jobs.depth() if jobs is not None else 0,
+        "cache": result_cache.stats() if result_cache is not None else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None
     })
 
+def format_event(fmt, event, payload):
+    """One SSE event or NDJSON line."""
+    if fmt == 'sse':
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps(payload) + "\n"
+
+def stream_generation(gen_requests, fmt):
+    """Stream previews (if requested) and then each finished image."""
+    events = queue.Queue()
+    for index, r in enumerate(gen_requests):
+        if r.preview_every:
+            # Runs on the batch thread; encoding happens here on the request thread
+            r.on_preview = lambda step, image, index=index: events.put(("preview", index, step, image))
+    # Submitted before streaming starts so a full queue is still a plain 429
+    submitted = jobs.submit_many(gen_requests, track=False, client=client_key())
+    for index, job in enumerate(submitted):
+        encode_data_uri(job.future).add_done_callback(
+            lambda future, index=index: events.put(("result", index, None, future)))
+    
+    def generate():
+        remaining = len(submitted)
+        try:
+            while remaining:
+                kind, index, step, value = events.get()
+                r = gen_requests[index]
+                if kind == "preview":
+                    yield format_event(fmt, "preview", {
+                        "index": index,
+                        "step": step,
+                        "steps": r.steps,
+                        "image": preview_to_data_uri(value),
+                    })
+                    continue
+                remaining -= 1
+                try:
+                    payload = {"index": index, "seed": r.seed, "image": value.result()[0]}
+                except CancelledError:
+                    payload = {"index": index, "error": str(GenerationCancelled())}
+                except Exception as e:
+                    payload = {"index": index, "error": str(e)}
+                yield format_event(fmt, "result", payload)
+            yield format_event(fmt, "done", {"done": True})
+        finally:
+            # Closed early when the client disconnects mid-stream
+            for job in submitted:
+                jobs.cancel(job, "disconnected")
+    
+    mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
 @app.route('/api/generate', methods=['POST'])
 def generate_image():
     try:
         data = request.get_json()
-        prompt = data.get('prompt', '')
-        negative_prompt = data.get('negative_prompt', 'blurry, bad quality, distorted')
-        num_inference_steps = data.get('steps', 20)
-        guidance_scale = data.get('guidance_scale', 7.5)
-        width = data.get('width', 512)
-        height = data.get('height', 512)
-        seed = data.get('seed', None)
+        try:
+            gen_requests = parse_generation_requests(data)
+            fmt = negotiate_format(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        gen_request = gen_requests[0]
         
-        if not prompt:
+        if not gen_request.prompt:
             return jsonify({"error": "No prompt provided"}), 400
+        if fmt is not None and len(gen_requests) > 1:
+            return jsonify({"error": "Binary formats return a single image; use JSON for num_images > 1"}), 400
+        
+        stream = stream_format(data)
+        if stream is not None:
+            if fmt is not None:
+                return jsonify({"error": "Streaming returns JSON events; drop format"}), 400
+            return stream_generation(gen_requests, stream)
+        
+        # Queue every variant together so they share one denoising loop
+        submitted = jobs.submit_many(gen_requests, track=False, client=client_key())
+        encoded = [encode_data_uri(job.future) for job in submitted] if fmt is None else None
+        wait_for_jobs(submitted)
         
-        # Set seed for reproducible results
-        if seed is not None:
-            torch.manual_seed(seed)
-        
-        # Generate image with device-appropriate autocast
-        device_type = "cuda" if torch.cuda.is_available() else "cpu"
-        if device_type == "cuda":
-            with torch.autocast(device_type):
-                image = pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    num_inference_steps=num_inference_steps,
-                    guidance_scale=guidance_scale,
-                    width=width,
-                    height=height
-                ).images[0]
-        else:
-            # CPU inference without autocast
-            image = pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                width=width,
-                height=height
-            ).images[0]
-        
-        # Convert to base64 for JSON response
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='PNG')
-        img_str = base64.b64encode(img_buffer.getvalue()).decode()
-        
-        return jsonify({
-            "prompt": prompt,
-            "image": f"data:image/png;base64,{img_str}",
-            "seed": seed,
+        if fmt is not None:
+            return image_response(submitted[0].result(), gen_request, fmt, data.get('quality'))
+        
+        uris = [future.result()[0] for future in encoded]
+        result = {
+            "prompt": gen_request.prompt,
+            "image": uris[0],
+            "seed": gen_request.seed,
             "parameters": {
-                "steps": num_inference_steps,
-                "guidance_scale": guidance_scale,
-                "width": width,
-                "height": height
+                "steps": gen_request.steps,
+                "guidance_scale": gen_request.guidance_scale,
+                "width": gen_request.width,
+                "height": gen_request.height,
+                "scheduler": gen_request.scheduler
             }
-        })
+        }
+        if len(gen_requests) > 1:
+            result["images"] = [
+                {"image": uri, "seed": r.seed}
+                for uri, r in zip(uris, gen_requests)
+            ]
+        return jsonify(result)
         
+    except QueueFullError as e:
+        return queue_full_response(e)
+    except (GenerationCancelled, CancelledError) as e:
+        return cancelled_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -119,101 +1014,379 @@ def generate_image():
 def generate_image_file():
     try:
         data = request.get_json()
-        prompt = data.get('prompt', '')
-        negative_prompt = data.get('negative_prompt', 'blurry, bad quality, distorted')
-        num_inference_steps = data.get('steps', 20)
-        guidance_scale = data.get('guidance_scale', 7.5)
-        width = data.get('width', 512)
-        height = data.get('height', 512)
-        seed = data.get('seed', None)
+        try:
+            gen_request = parse_generation_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        if not prompt:
+        if not gen_request.prompt:
             return jsonify({"error": "No prompt provided"}), 400
         
-        if seed is not None:
-            torch.manual_seed(seed)
-        
-        # Generate image with device-appropriate autocast
-        device_type = "cuda" if torch.cuda.is_available() else "cpu"
-        if device_type == "cuda":
-            with torch.autocast(device_type):
-                image = pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    num_inference_steps=num_inference_steps,
-                    guidance_scale=guidance_scale,
-                    width=width,
-                    height=height
-                ).images[0]
-        else:
-            # CPU inference without autocast
-            image = pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                width=width,
-                height=height
-            ).images[0]
-        
-        # Save to temporary file
-        filename = f"generated_{uuid.uuid4()}.png"
-        filepath = f"/tmp/{filename}"
-        image.save(filepath)
-        
-        return send_file(filepath, as_attachment=True, download_name=filename)
+        try:
+            fmt = negotiate_format(data, default='png') or 'png'
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        job = jobs.submit(gen_request, track=False, client=client_key())
+        wait_for_jobs([job])
+        image = job.result()
+        
+        # Encode in memory rather than leaving files behind in /tmp
+        return image_response(image, gen_request, fmt, data.get('quality'), as_attachment=True)
         
+    except QueueFullError as e:
+        return queue_full_response(e)
+    except (GenerationCancelled, CancelledError) as e:
+        return cancelled_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def stream_format(data):
+    """Pick 'ndjson', 'sse' or None from the body's stream field or Accept header."""
+    stream = data.get('stream')
+    if stream in ('ndjson', 'sse'):
+        return stream
+    if stream is True:
+        return 'ndjson'
+    accept = request.headers.get('Accept', '')
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    return None
+
+def batch_result(index, prompt, encoded):
+    """One batch entry from its encoding future, reporting a failure instead of raising it."""
+    try:
+        return {"index": index, "prompt": prompt, "image": encoded.result()[0]}
+    except CancelledError:
+        return {"index": index, "prompt": prompt, "error": str(GenerationCancelled())}
+    except Exception as e:
+        return {"index": index, "prompt": prompt, "error": str(e)}
+
+def stream_batch(prompts, pending, failed, fmt, submitted):
+    """Yield each batch result as soon as it is ready, then a summary."""
+    try:
+        for entry in failed:
+            yield format_event(fmt, "result", entry)
+        errors = len(failed)
+        for future in as_completed(list(pending)):
+            # Drop our reference so the image is freed once it has been sent
+            index = pending.pop(future)
+            entry = batch_result(index, prompts[index], future)
+            if "error" in entry:
+                errors += 1
+            yield format_event(fmt, "result", entry)
+        yield format_event(fmt, "done", {"done": True, "completed": len(prompts) - errors, "failed": errors})
+    finally:
+        # Closed early when the client disconnects mid-stream
+        for job in submitted:
+            jobs.cancel(job, "disconnected")
+
+@app.route('/api/estimate', methods=['GET', 'POST'])
+def estimate():
+    """Predict latency and peak memory for a generation without running it."""
+    data = request.get_json(silent=True) or request.args.to_dict()
+    try:
+        gen_requests = parse_generation_requests(data, check_cost=False)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    r = gen_requests[0]
+    num_images = len(gen_requests)
+    cost = sum(generation_cost(gr) for gr in gen_requests)
+    # Variants are submitted together, so they run in as few batches as possible
+    full, rest = divmod(num_images, BATCH_MAX_SIZE)
+    seconds = full * cost_model.predict_seconds(r.steps, r.width, r.height, BATCH_MAX_SIZE)
+    if rest:
+        seconds += cost_model.predict_seconds(r.steps, r.width, r.height, rest)
+    queue_seconds = jobs.backlog_seconds()
+    
+    batch_size = min(num_images, BATCH_MAX_SIZE)
+    memory_options = {}
+    if memory_policy is not None:
+        batch_size = memory_policy.max_batch_size(r.width, r.height, batch_size)
+        memory_options = memory_policy.plan(r.width, r.height, batch_size) or {}
+    
+    try:
+        admission.check_request(cost)
+        if memory_policy is not None:
+            memory_policy.check(r.width, r.height)
+        reason = None
+    except ValueError as e:
+        reason = str(e)
+    
+    return jsonify({
+        "cost": round(cost, 1),
+        "seconds": round(seconds, 1),
+        "queue_seconds": round(queue_seconds, 1),
+        "total_seconds": round(seconds + queue_seconds, 1),
+        "peak_memory_bytes": cost_model.predict_peak_bytes(r.width, r.height, batch_size, **memory_options),
+        "memory_options": sorted(memory_options),
+        "admissible": reason is None,
+        "reason": reason,
+        "model": cost_model.state(),
+    })
+
 @app.route('/api/batch_generate', methods=['POST'])
 def batch_generate():
     try:
         data = request.get_json()
         prompts = data.get('prompts', [])
-        negative_prompt = data.get('negative_prompt', 'blurry, bad quality, distorted')
-        num_inference_steps = data.get('steps', 20)
-        guidance_scale = data.get('guidance_scale', 7.5)
         
         if not prompts:
             return jsonify({"error": "No prompts provided"}), 400
         
-        results = []
-        for i, prompt in enumerate(prompts):
-            device_type = "cuda" if torch.cuda.is_available() else "cpu"
-            if device_type == "cuda":
-                with torch.autocast(device_type):
-                    image = pipe(
-                        prompt=prompt,
-                        negative_prompt=negative_prompt,
-                        num_inference_steps=num_inference_steps,
-                        guidance_scale=guidance_scale
-                    ).images[0]
-            else:
-                # CPU inference without autocast
-                image = pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    num_inference_steps=num_inference_steps,
-                    guidance_scale=guidance_scale
-                ).images[0]
-            
-            img_buffer = io.BytesIO()
-            image.save(img_buffer, format='PNG')
-            img_str = base64.b64encode(img_buffer.getvalue()).decode()
-            
-            results.append({
-                "prompt": prompt,
-                "image": f"data:image/png;base64,{img_str}"
-            })
+        try:
+            gen_requests = [parse_generation_request(data, prompt=prompt) for prompt in prompts]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Submit every prompt up front so the scheduler can batch them
+        pending = {}
+        failed = []
+        submitted = []
+        client = client_key()
+        for index, (prompt, gen_request) in enumerate(zip(prompts, gen_requests)):
+            try:
+                job = jobs.submit(gen_request, track=False, client=client)
+                submitted.append(job)
+                pending[job.future] = index
+            except QueueFullError as e:
+                if not pending and not failed:
+                    return queue_full_response(e)
+                failed.append({"index": index, "prompt": prompt, "error": str(e)})
+        
+        # Keyed by the encoding futures, which finish after their generations
+        pending = {encode_data_uri(future): index for future, index in pending.items()}
+        fmt = stream_format(data)
+        if fmt is not None:
+            mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+            return Response(stream_with_context(stream_batch(prompts, pending, failed, fmt, submitted)),
+                            mimetype=mimetype)
+        
+        wait_for_jobs(submitted)
+        results = failed + [batch_result(index, prompts[index], future)
+                            for future, index in pending.items()]
+        results.sort(key=lambda entry: entry["index"])
         
         return jsonify({"results": results})
         
+    except GenerationCancelled as e:
+        return cancelled_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def require_admin():
+    """Return an error response unless the request carries ADMIN_TOKEN."""
+    if ADMIN_TOKEN is None:
+        return jsonify({"error": "Admin endpoints are disabled; set ADMIN_TOKEN"}), 403
+    if request.headers.get('Authorization', '') != f"Bearer {ADMIN_TOKEN}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+@app.route('/api/admin/lora_scale', methods=['POST'])
+def set_lora_scale():
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    if adapters is not None:
+        return jsonify({"error": "Adapters are served unfused; pass lora_scale per request instead"}), 409
+    if lora_fusion is None:
+        return jsonify({"error": "LoRA is not served fused; set LORA_FUSE=1 without QUANTIZE_INT8"}), 409
+    
+    try:
+        scale = float(request.get_json().get('scale'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "scale must be a number"}), 400
+    
+    start = time.perf_counter()
+    # Wait for the running batch, then re-fuse before the next one starts
+    with pipe_lock:
+        lora_fusion.fuse(scale)
+        fingerprint = current_fingerprint()
+        result_cache.fingerprint = fingerprint
+        embedding_cache.bind(pipe, fingerprint)
+        embedding_cache.precompute(DEFAULT_NEGATIVE_PROMPT)
+    
+    return jsonify({
+        "lora": lora_fusion.state(),
+        "seconds": round(time.perf_counter() - start, 2)
+    })
+
+@app.route('/api/admin/lora_reload', methods=['POST'])
+def admin_reload_lora():
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    
+    data = request.get_json(silent=True) or {}
+    name = data.get('adapter', 'default')
+    try:
+        result = reload_lora(name, data.get('path'))
+    except UnknownAdapterError:
+        return jsonify({"error": f"Unknown adapter: {name}"}), 404
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        # Includes failed validation; the previous weights are still being served
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    if lora_watcher is not None:
+        lora_watcher.mark_current(name, result["path"])
+    return jsonify(result)
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    try:
+        data = request.get_json()
+        try:
+            gen_requests = parse_generation_requests(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        if not gen_requests[0].prompt:
+            return jsonify({"error": "No prompt provided"}), 400
+        
+        infos = []
+        for job in jobs.submit_many(gen_requests, client=client_key()):
+            info = jobs.describe(job)
+            info["status_url"] = url_for('get_job', job_id=job.id)
+            info["result_url"] = url_for('get_job_result', job_id=job.id)
+            infos.append(info)
+        
+        # One job per image; several images are reported as a list
+        response = jsonify(infos[0] if len(infos) == 1 else {"jobs": infos})
+        response.headers["Location"] = infos[0]["status_url"]
+        return response, 202
+        
+    except QueueFullError as e:
+        return queue_full_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def forward_to_owner(job_id):
+    """
+    Proxy a job request to the worker process that owns the job.
+
+    Returns None when this process owns it (or is the only one).
+    """
+    prefix, _, _ = job_id.partition("-")
+    if worker_index is None or not prefix[1:].isdigit() or int(prefix[1:]) == worker_index:
+        return None
+    owner = int(prefix[1:])
+    headers = {name: request.headers[name] for name in ("Accept", "Authorization") if name in request.headers}
+    forwarded = urllib.request.Request(f"http://127.0.0.1:{WORKER_PORT_BASE + owner}{request.full_path}",
+                                       method=request.method, headers=headers)
+    try:
+        upstream = urllib.request.urlopen(forwarded, timeout=30)
+    except urllib.error.HTTPError as e:
+        upstream = e
+    except OSError as e:
+        return jsonify({"error": f"Worker {owner} owning this job is unavailable: {e}"}), 503
+    with upstream:
+        skip = {"connection", "content-length", "transfer-encoding", "server", "date"}
+        return Response(upstream.read(), upstream.status,
+                        [(name, value) for name, value in upstream.headers.items() if name.lower() not in skip])
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        forwarded = forward_to_owner(job_id)
+        return forwarded if forwarded is not None else (jsonify({"error": "Job not found"}), 404)
+    return jsonify(jobs.describe(job))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        forwarded = forward_to_owner(job_id)
+        return forwarded if forwarded is not None else (jsonify({"error": "Job not found"}), 404)
+    if not jobs.cancel(job):
+        return jsonify({"error": "Job already finished", "status": job.status}), 409
+    # Queued jobs are cancelled at once; running ones stop at their next step
+    return jsonify(jobs.describe(job)), 202
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        forwarded = forward_to_owner(job_id)
+        return forwarded if forwarded is not None else (jsonify({"error": "Job not found"}), 404)
+    
+    status = job.status
+    if status == "cancelled":
+        return jsonify({"error": job.error(), "status": status}), 410
+    if status == "failed":
+        return jsonify({"error": job.error(), "status": status}), 500
+    if status != "done":
+        return jsonify({"error": "Job not finished", "status": status}), 409
+    
+    try:
+        fmt = negotiate_format(request.args, default='png') or 'png'
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return image_response(job.result(), job.request, fmt, request.args.get('quality'))
+
+@app.route('/api/workers', methods=['GET'])
+def workers_status():
+    """Per-worker health in pre-fork mode: heartbeats, memory and restarts."""
+    if worker_index is None:
+        return jsonify({"error": "Not running in pre-fork mode (WORKERS=1)"}), 404
+    return jsonify(worker_states(WORKER_STATUS_DIR, WORKER_HEARTBEAT_TIMEOUT))
+
+def worker_heartbeat():
+    status = loading_status()
+    return dict(
+        phase=status["phase"],
+        ready=status["ready"],
+        error=status["error"],
+        queue_depth=jobs.depth() if jobs is not None else 0,
+        cores=engine_settings.get("cores"),
+        **process_memory(),
+    )
+
+def run_worker(index, sock):
+    """Entry point of a forked worker: start the engine and serve on the shared socket."""
+    from werkzeug.serving import make_server
+    
+    global worker_index
+    worker_index = index
+    # Before any thread exists, so torch's pool (and every later thread) inherits it
+    groups = partition_cores(WORKERS)
+    engine_settings.update(configure_worker_cores(groups[index % len(groups)], affinity=CPU_AFFINITY,
+                                                  intra_op_threads=CPU_THREADS))
+    Heartbeat(WORKER_STATUS_DIR, index, worker_heartbeat, interval=min(5.0, WORKER_HEARTBEAT_TIMEOUT / 4)).start()
+    private = make_server("127.0.0.1", WORKER_PORT_BASE + index, app, threaded=True)
+    threading.Thread(target=private.serve_forever, name="worker-forwarding", daemon=True).start()
+    load_model_in_background(start_engine)
+    make_server("0.0.0.0", PORT, app, threaded=True, fd=sock.fileno()).serve_forever()
+
+def serve_prefork():
+    """Load the weights once, then fork WORKERS processes that share them copy-on-write."""
+    global admission
+    sock = listen_socket("0.0.0.0", PORT)
+    print(f"Loading model before forking {WORKERS} workers ({EXECUTION_PROFILE} profile)...")
+    # LoRA fusion, quantization and channels_last copies are parallel ATen
+    # ops; an OpenMP pool started here would not survive the fork, so the
+    # parent loads on one thread and each worker sizes its own pool
+    torch.set_num_threads(1)
+    load_pipeline(workers=WORKERS)
+    # Limits are server-wide; every worker admits its share of the work
+    admission = AdmissionController(MAX_INFLIGHT_COST, CLIENT_BUDGET, CLIENT_BUDGET_REFILL, shares=WORKERS)
+    Supervisor(WORKERS, lambda index: run_worker(index, sock), WORKER_STATUS_DIR,
+               heartbeat_timeout=WORKER_HEARTBEAT_TIMEOUT).run()
+
 if __name__ == '__main__':
-    print("Loading model...")
-    load_model()
-    print("Model loaded successfully!")
-    app.run(host='0.0.0.0', port=7860)
+    if WORKERS > 1 and not torch.cuda.is_available():
+        serve_prefork()
+    else:
+        if WORKERS > 1:
+            # CUDA contexts do not survive fork
+            print("WORKERS > 1 is only supported on CPU, serving with one process")
+        print("Loading model in the background...")
+        load_model_in_background()
+        app.run(host='0.0.0.0', port=PORT)
@@ -0,0 +1,219 @@
+"""
+Registry of named LoRA adapters served from one base pipeline.
+
+Adapters are loaded on demand with ``load_lora_weights(..., adapter_name=...)``
+and activated per batch with ``set_adapters``. At most ``max_resident``
+adapters stay loaded; the least recently used one is deleted to make room.
+Callers must hold the pipeline lock while activating or replacing, since
+loading and switching adapters mutates the shared UNet.
+
+Each adapter is loaded under an internal name that includes its weight
+fingerprint, so a new version can sit next to the serving one until it has
+been validated.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from pipeline.cache import fingerprint_files
+
+# Same search order as pipeline/text2img.py
+WEIGHT_NAMES = (
+    "pytorch_lora_weights.safetensors",
+    "pytorch_lora_weights.bin",
+    "adapter_model.safetensors",
+    "lora_weights.safetensors",
+    "diffusion_pytorch_model.safetensors",
+)
+
+
+class UnknownAdapterError(KeyError):
+    """Raised when a request names an adapter that is not registered."""
+
+
+def find_weight_name(path):
+    """Return the LoRA weight file name inside ``path``, or None."""
+    for name in WEIGHT_NAMES:
+        if os.path.exists(os.path.join(path, name)):
+            return name
+    return None
+
+
+def load_state_dict(path):
+    """Read the LoRA weights in ``path`` into memory, without touching any pipeline."""
+    weight_name = find_weight_name(path)
+    if weight_name is None:
+        raise FileNotFoundError(f"No LoRA weights found in {path}")
+    file_path = os.path.join(path, weight_name)
+    if weight_name.endswith(".safetensors"):
+        from safetensors.torch import load_file
+        return load_file(file_path)
+    import torch
+    return torch.load(file_path, map_location="cpu")
+
+
+def discover_adapters(root):
+    """Map every subdirectory of ``root`` that holds LoRA weights to its path."""
+    adapters = {}
+    if not root or not os.path.isdir(root):
+        return adapters
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and find_weight_name(path):
+            adapters[name] = path
+    return adapters
+
+
+def parse_adapter_list(value):
+    """Parse "name=path,name2=path2" into a dict."""
+    adapters = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, path = item.split("=", 1)
+            adapters[name.strip()] = path.strip()
+    return adapters
+
+
+class AdapterRegistry:
+    """
+    Named LoRA adapters with LRU residency.
+
+    Args:
+        pipe: StableDiffusionPipeline the adapters are loaded into.
+        sources (dict): Adapter name -> directory with its weights.
+        max_resident (int): Adapters kept loaded at the same time.
+    """
+
+    def __init__(self, pipe, sources, max_resident=3):
+        self.pipe = pipe
+        self.sources = dict(sources)
+        self.max_resident = max(1, int(max_resident))
+        self.loads = 0
+        self.evictions = 0
+        # Adapter name -> name it is loaded under in the pipeline
+        self._resident = OrderedDict()
+        self._fingerprints = {}
+        self._active = None
+        self._lock = threading.Lock()
+
+    def names(self):
+        with self._lock:
+            return sorted(self.sources)
+
+    def paths(self):
+        """Copy of the adapter name -> directory mapping."""
+        with self._lock:
+            return dict(self.sources)
+
+    def has(self, name):
+        with self._lock:
+            return name in self.sources
+
+    def fingerprint(self, name):
+        """Content hash of an adapter's weights, computed once per registration."""
+        with self._lock:
+            if name not in self.sources:
+                raise UnknownAdapterError(name)
+            return self._fingerprint_locked(name)
+
+    def _fingerprint_locked(self, name):
+        if name not in self._fingerprints:
+            self._fingerprints[name] = fingerprint_files(self.sources[name])
+        return self._fingerprints[name]
+
+    def affects_text_encoder(self, name):
+        """True if the adapter has layers in the text encoder."""
+        peft_config = getattr(self.pipe.text_encoder, "peft_config", None) or {}
+        with self._lock:
+            return self._resident.get(name) in peft_config
+
+    def activate(self, name, scale=1.0, extra=()):
+        """
+        Make ``name`` the active adapter at ``scale``, loading it if needed.
+
+        ``extra`` lists further (name, scale) pairs to stack on top, e.g. an
+        LCM LoRA for few-step sampling.
+        """
+        wanted = ((name, scale),) + tuple(extra)
+        with self._lock:
+            for adapter, _ in wanted:
+                if adapter not in self.sources:
+                    raise UnknownAdapterError(adapter)
+            for adapter, _ in wanted:
+                if adapter not in self._resident:
+                    self._load(adapter, keep={a for a, _ in wanted})
+                self._resident.move_to_end(adapter)
+            if self._active != wanted:
+                self.pipe.set_adapters([self._resident[a] for a, _ in wanted],
+                                       adapter_weights=[s for _, s in wanted])
+                self._active = wanted
+
+    def replace(self, name, state_dict, fingerprint, validate, scale=1.0, path=None):
+        """
+        Swap in new weights for ``name`` once they pass validation.
+
+        Args:
+            name (str): Registered adapter to replace.
+            state_dict (dict): New LoRA weights, already read from disk.
+            fingerprint (str): Content hash of the new weights.
+            validate (callable): Runs a generation with the new weights
+                active and raises if the result is unusable.
+            scale (float): Scale to validate at.
+            path (str): New source directory, if it moved.
+        """
+        with self._lock:
+            if name not in self.sources:
+                raise UnknownAdapterError(name)
+            shadow = f"{name}@{fingerprint}"
+            previous = self._resident.get(name)
+            if shadow == previous:
+                return
+            if previous is None:
+                self._make_room()
+            self.pipe.load_lora_weights(dict(state_dict), adapter_name=shadow)
+            self.pipe.set_adapters([shadow], adapter_weights=[scale])
+            self._active = None
+            try:
+                validate()
+            except Exception:
+                self.pipe.delete_adapters(shadow)
+                raise
+            if previous is not None:
+                self.pipe.delete_adapters(previous)
+            self._resident[name] = shadow
+            self._resident.move_to_end(name)
+            self._fingerprints[name] = fingerprint
+            if path:
+                self.sources[name] = path
+            self.loads += 1
+            print(f"Replaced LoRA adapter '{name}' with weights {fingerprint}")
+
+    def _make_room(self, keep=()):
+        candidates = [name for name in self._resident if name not in keep]
+        while len(self._resident) >= self.max_resident and candidates:
+            evicted = candidates.pop(0)
+            self.pipe.delete_adapters(self._resident.pop(evicted))
+            self.evictions += 1
+            if self._active and evicted in dict(self._active):
+                self._active = None
+            print(f"Evicted LoRA adapter '{evicted}'")
+
+    def _load(self, name, keep=()):
+        self._make_room(keep)
+        path = self.sources[name]
+        loaded_as = f"{name}@{self._fingerprint_locked(name)}"
+        self.pipe.load_lora_weights(path, weight_name=find_weight_name(path), adapter_name=loaded_as)
+        self._resident[name] = loaded_as
+        self.loads += 1
+        print(f"Loaded LoRA adapter '{name}' from {path}")
+
+    def state(self):
+        with self._lock:
+            return {
+                "available": sorted(self.sources),
+                "resident": list(self._resident),
+                "active": [name for name, _ in self._active] if self._active else [],
+                "max_resident": self.max_resident,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,135 @@
+"""
+Cost-aware admission control.
+
+Denoising cost grows with the number of steps, the latent area and the
+number of images, so requests are weighed in cost units: one unit is one
+denoising step of one 512x512 image. The controller enforces a global limit
+on the cost of admitted but unfinished work and, optionally, a token bucket
+per client so a single caller cannot occupy the server.
+"""
+import math
+import threading
+import time
+
+from pipeline.jobs import QueueFullError
+
+# Latent pixels of a 512x512 image (the VAE downsamples by 8)
+UNIT_LATENT_AREA = (512 // 8) * (512 // 8)
+
+
+def request_cost(steps, width, height, batch_size=1):
+    """Cost in units of one 512x512 denoising step."""
+    latent_area = (int(width) // 8) * (int(height) // 8)
+    return int(steps) * latent_area * int(batch_size) / UNIT_LATENT_AREA
+
+
+class BudgetExceededError(QueueFullError):
+    """Raised when a client has spent its budget or the server is at capacity."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(retry_after)
+        self.args = (message,)
+
+
+class AdmissionController:
+    """
+    Admits work while the in-flight cost and per-client budgets allow it.
+
+    Args:
+        max_inflight_cost (float): Cost of admitted, unfinished work the
+            server accepts in total; 0 disables the limit.
+        client_budget (float): Token bucket size per client in cost units;
+            0 disables per-client budgets.
+        client_refill (float): Units per second added back to each bucket.
+        shares (int): Processes enforcing these limits together, e.g.
+            pre-fork workers. Each admits 1/shares of the in-flight cost and
+            of every client's budget and refill; single requests are still
+            checked against the full limits, and one larger than a share
+            runs once this process is idle or the client's bucket is full.
+    """
+
+    def __init__(self, max_inflight_cost=0, client_budget=0, client_refill=1.0, shares=1):
+        self.max_inflight_cost = float(max_inflight_cost)
+        self.client_budget = float(client_budget)
+        self.shares = max(1, int(shares))
+        self.inflight_limit = self.max_inflight_cost / self.shares
+        self.bucket_size = self.client_budget / self.shares
+        self.client_refill = max(1e-6, float(client_refill) / self.shares)
+        self.inflight_cost = 0.0
+        self.rejected = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def check_request(self, cost):
+        """Raise ValueError for a request that could never be admitted."""
+        if self.max_inflight_cost and cost > self.max_inflight_cost:
+            raise ValueError(
+                f"Request cost {cost:.0f} exceeds the server limit of {self.max_inflight_cost:.0f} "
+                "units; lower steps, width, height or num_images"
+            )
+        if self.client_budget and cost > self.client_budget:
+            raise ValueError(
+                f"Request cost {cost:.0f} exceeds the per-client budget of {self.client_budget:.0f} "
+                "units; lower steps, width, height or num_images"
+            )
+
+    def admit(self, client, cost, retry_after=1):
+        """
+        Reserve ``cost`` for ``client`` or raise BudgetExceededError.
+
+        ``retry_after`` is the server's own guess for when capacity frees
+        up, used when the global limit is what rejects the request.
+        """
+        self.check_request(cost)
+        with self._lock:
+            # An idle process takes any valid request, even one larger than its share
+            if (self.max_inflight_cost and self.inflight_cost > 0
+                    and self.inflight_cost + cost > self.inflight_limit):
+                self.rejected += 1
+                raise BudgetExceededError(
+                    f"Server is at capacity ({self.inflight_cost:.0f} of "
+                    f"{self.inflight_limit:.0f} cost units in flight), retry later",
+                    retry_after,
+                )
+            if self.client_budget:
+                available = self._refill(client)
+                # A full bucket pays for a larger request by going into debt
+                if cost > available and available < self.bucket_size:
+                    self.rejected += 1
+                    wait = math.ceil((min(cost, self.bucket_size) - available) / self.client_refill)
+                    raise BudgetExceededError(
+                        f"Budget exceeded: request costs {cost:.0f} units, "
+                        f"{max(0.0, available):.0f} of {self.bucket_size:.0f} left",
+                        max(1, wait),
+                    )
+                self._buckets[client] = (available - cost, time.monotonic())
+                if len(self._buckets) > 4096:
+                    self._prune()
+            self.inflight_cost += cost
+
+    def release(self, cost):
+        """Return in-flight capacity once admitted work has finished."""
+        with self._lock:
+            self.inflight_cost = max(0.0, self.inflight_cost - cost)
+
+    def _refill(self, client):
+        level, updated = self._buckets.get(client, (self.bucket_size, time.monotonic()))
+        level = min(self.bucket_size, level + (time.monotonic() - updated) * self.client_refill)
+        return level
+
+    def _prune(self):
+        # Full buckets carry no state worth keeping
+        for client in list(self._buckets):
+            if self._refill(client) >= self.bucket_size:
+                del self._buckets[client]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "inflight_cost": round(self.inflight_cost, 1),
+                "max_inflight_cost": self.inflight_limit or None,
+                "client_budget": self.bucket_size or None,
+                "shares": self.shares,
+                "clients": len(self._buckets),
+                "rejected": self.rejected,
+            }
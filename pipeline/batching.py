@@ -0,0 +1,252 @@
+"""
+Dynamic request batching.
+
+Concurrent generation requests are queued and coalesced into a single
+batched forward pass when their shape parameters match. A batch is closed
+when it reaches ``max_batch_size`` or when ``max_wait`` seconds have passed
+since its first request arrived.
+
+Requests can be cancelled or given a deadline. Queued requests that are
+cancelled or past their deadline are dropped before they reach a batch;
+running ones are checked by the caller's step callback, and their results
+are discarded in favour of a GenerationCancelled error.
+
+Requests for the LoRA adapter that ran last are preferred over older
+requests for another adapter, for up to ``max_group_wait`` seconds, so a
+mixed queue does not switch adapters on every batch.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class GenerationCancelled(Exception):
+    """Raised for a request that was cancelled or ran past its deadline."""
+
+    def __init__(self, reason="cancelled"):
+        messages = {
+            "cancelled": "Generation cancelled",
+            "deadline": "Generation deadline exceeded",
+            "disconnected": "Client disconnected",
+        }
+        super().__init__(messages.get(reason, reason))
+        self.reason = reason
+
+
+class GenerationRequest:
+    """One image request waiting for the batch scheduler."""
+
+    def __init__(self, prompt, negative_prompt, guidance_scale=7.5, seed=None,
+                 steps=20, width=512, height=512, scheduler="dpmpp_2m",
+                 adapter=None, lora_scale=None):
+        self.prompt = prompt
+        self.negative_prompt = negative_prompt
+        self.guidance_scale = float(guidance_scale)
+        self.seed = seed
+        self.steps = int(steps)
+        self.width = int(width)
+        self.height = int(height)
+        self.scheduler = scheduler
+        self.adapter = adapter
+        self.lora_scale = lora_scale
+        # Content hash of the adapter's weights, set by the server for cache keys
+        self.adapter_fingerprint = None
+        # Called as on_preview(step, image) every preview_every steps, if set
+        self.preview_every = 0
+        self.on_preview = None
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        # Size of the batch the request ran in, set when it starts
+        self.batch_size = 1
+        # Monotonic time after which the request is abandoned, if any
+        self.deadline = None
+        self.steps_done = 0
+        self._cancel_reason = None
+
+    def cancel(self, reason="cancelled"):
+        """Cancel the request; a running one stops at its next step check."""
+        if self.future.done():
+            return False
+        if self._cancel_reason is None:
+            self._cancel_reason = reason
+        # Succeeds only while the request is still queued
+        self.future.cancel()
+        return True
+
+    def cancel_reason(self):
+        """'cancelled', 'disconnected' or 'deadline' if the request should stop, else None."""
+        if self._cancel_reason is not None:
+            return self._cancel_reason
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            return "deadline"
+        return None
+
+    def batch_key(self):
+        """Requests with equal keys can share one denoising loop."""
+        return (self.steps, self.width, self.height, self.scheduler,
+                self.adapter, self.lora_scale)
+
+    def group_key(self):
+        """Batches for the same group can run without switching adapters."""
+        return self.adapter
+
+
+class BatchScheduler:
+    """
+    Background worker that groups compatible requests into batches.
+
+    Args:
+        run_batch (callable): Called with a list of GenerationRequest and
+            returns one result per request, in order.
+        max_batch_size (int): Upper bound on requests per batch.
+        max_wait (float): Seconds to hold a batch open for more requests.
+        max_group_wait (float): How long the oldest request may be passed
+            over in favour of requests for the current adapter.
+        on_cancel (callable): Called as ``on_cancel(request, reason)`` for
+            every request dropped or stopped because it was cancelled.
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait=0.05, max_group_wait=2.0,
+                 on_cancel=None):
+        self.run_batch = run_batch
+        self.on_cancel = on_cancel
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait))
+        self.max_group_wait = max(0.0, float(max_group_wait))
+        self._last_group = None
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def submit(self, request):
+        """Queue a request and return its Future."""
+        return self.submit_many([request])[0]
+
+    def submit_many(self, requests):
+        """Queue several requests at once so they land in the same batch."""
+        with self._cond:
+            self._pending.extend(requests)
+            self._cond.notify_all()
+        return [r.future for r in requests]
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _take_batch(self):
+        """
+        Block until a batch is ready and remove it from the queue.
+
+        Returns (batch, dropped) where ``dropped`` holds cancelled requests
+        that were removed from the queue along the way.
+        """
+        dropped = []
+        with self._cond:
+            while True:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return [], dropped
+                # Cancelled requests must not decide the shape of a batch
+                live = deque()
+                for r in self._pending:
+                    (dropped if r.cancel_reason() else live).append(r)
+                self._pending = live
+                if live:
+                    break
+                if dropped:
+                    # Resolve them now rather than when the next request arrives
+                    return [], dropped
+
+            # The head request decides the shape of this batch
+            head = self._pick_head()
+            key = head.batch_key()
+            deadline = head.submitted_at + self.max_wait
+            while True:
+                matching = sum(1 for r in self._pending if r.batch_key() == key)
+                remaining = deadline - time.monotonic()
+                if matching >= self.max_batch_size or remaining <= 0 or self._stopped:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            rest = deque()
+            for r in self._pending:
+                if len(batch) < self.max_batch_size and r.batch_key() == key:
+                    batch.append(r)
+                else:
+                    rest.append(r)
+            self._pending = rest
+            self._last_group = head.group_key()
+            return batch, dropped
+
+    def _pick_head(self):
+        """Oldest request, unless a request for the current adapter can go first."""
+        oldest = self._pending[0]
+        if (self._last_group is None or oldest.group_key() == self._last_group
+                or time.monotonic() - oldest.submitted_at > self.max_group_wait):
+            return oldest
+        for r in self._pending:
+            if r.group_key() == self._last_group:
+                return r
+        return oldest
+
+    def _cancelled(self, r, reason):
+        if self.on_cancel is not None:
+            self.on_cancel(r, reason)
+        if not r.future.done():
+            r.future.set_exception(GenerationCancelled(reason))
+
+    def _loop(self):
+        while True:
+            batch, dropped = self._take_batch()
+            for r in dropped:
+                # Cancelled futures are already resolved; expired ones need an error
+                if r.future.set_running_or_notify_cancel():
+                    self._cancelled(r, r.cancel_reason())
+                elif self.on_cancel is not None:
+                    self.on_cancel(r, r.cancel_reason())
+            if not batch:
+                if self._stopped:
+                    return
+                continue
+            # Skip requests whose callers have already given up
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started_at = time.monotonic()
+            for r in batch:
+                r.started_at = started_at
+                r.batch_size = len(batch)
+            try:
+                results = self.run_batch(batch)
+            except GenerationCancelled:
+                # The whole batch was abandoned part way through
+                for r in batch:
+                    self._cancelled(r, r.cancel_reason() or "cancelled")
+                continue
+            except Exception as e:
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+            for r, result in zip(batch, results):
+                # A finished image is still delivered if only its deadline passed
+                reason = r._cancel_reason
+                if reason is not None:
+                    self._cancelled(r, reason)
+                else:
+                    r.future.set_result(result)
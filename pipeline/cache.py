@@ -0,0 +1,195 @@
+"""
+Content-addressed cache of generated images.
+
+A seeded request is fully determined by its parameters and the loaded
+weights, so its result can be reused. Entries are keyed by a hash of the
+normalized request plus a fingerprint of the LoRA weights and kept in an
+in-memory LRU tier with an optional on-disk tier bounded by total size.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def fingerprint_files(path):
+    """Hash every file under ``path`` (names and contents) into a short id."""
+    digest = hashlib.sha256()
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+    for file_path in paths:
+        # Training logs change without changing the weights
+        if not file_path.endswith((".safetensors", ".bin", ".json")):
+            continue
+        digest.update(os.path.relpath(file_path, path).encode())
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def normalize_prompt(text):
+    # The CLIP tokenizer splits on whitespace, so runs of it are equivalent
+    return " ".join((text or "").split())
+
+
+class ResultCache:
+    """
+    Two-tier LRU cache of PNG-encoded results.
+
+    Args:
+        fingerprint (str): Identifies the loaded model and LoRA weights.
+        max_entries (int): Entries kept in memory.
+        disk_dir (str): Directory for the on-disk tier, or None to disable it.
+        disk_max_bytes (int): Size limit for the on-disk tier.
+    """
+
+    def __init__(self, fingerprint, max_entries=64, disk_dir=None, disk_max_bytes=1 << 30):
+        self.fingerprint = fingerprint
+        self.max_entries = max(0, int(max_entries))
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    def key_for(self, gen_request):
+        """Cache key for a request, or None if the request is not cacheable."""
+        if gen_request.seed is None:
+            return None
+        fields = {
+            "fingerprint": self.fingerprint,
+            "prompt": normalize_prompt(gen_request.prompt),
+            "negative_prompt": normalize_prompt(gen_request.negative_prompt),
+            "steps": int(gen_request.steps),
+            "guidance_scale": round(float(gen_request.guidance_scale), 4),
+            "width": int(gen_request.width),
+            "height": int(gen_request.height),
+            "seed": int(gen_request.seed),
+            "scheduler": gen_request.scheduler,
+            "adapter": gen_request.adapter,
+            "adapter_fingerprint": gen_request.adapter_fingerprint,
+            "lora_scale": gen_request.lora_scale,
+        }
+        canonical = json.dumps(fields, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key):
+        """Return the cached PIL image for ``key`` or None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            elif key in self._disk:
+                data = self._read_disk(key)
+                if data is not None:
+                    self._remember(key, data)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return Image.open(io.BytesIO(data))
+
+    def put(self, key, image):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        self.put_encoded(key, buffer.getvalue())
+
+    def put_encoded(self, key, data):
+        """Store PNG bytes encoded elsewhere, e.g. on an EncoderPool."""
+        with self._lock:
+            self._remember(key, data)
+            if not self.disk_dir or key in self._disk:
+                return
+        # Written outside the lock so lookups do not wait on the disk
+        if self._write_disk(key, data):
+            with self._lock:
+                if key not in self._disk:
+                    self._disk[key] = len(data)
+                    self._disk_bytes += len(data)
+                    self._evict_disk()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _remember(self, key, data):
+        if self.max_entries == 0:
+            return
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def _scan_disk(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".png"):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        # Oldest first so eviction order survives restarts
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+        self._disk.move_to_end(key)
+        return data
+
+    def _write_disk(self, key, data):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to write cache entry {key}: {e}")
+            return False
+        return True
+
+    def _evict_disk(self):
+        while self._disk and self._disk_bytes > self.disk_max_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
@@ -0,0 +1,215 @@
+"""
+Latency and peak-memory model for batched generation.
+
+Latency is modelled per stage, in cost units of latent area (one unit is a
+512x512 image):
+
+    seconds = overhead + steps * (step_base + step_per_unit * units * batch)
+              + decode_per_unit * units * batch
+
+The coefficients start from rough CPU defaults and are fitted to timings of
+real batches: warmup runs at startup, every served batch afterwards, or an
+offline calibration file written by ``benchmarks/calibrate_cost_model.py``.
+Recent observations weigh more than old ones so the model tracks the host.
+
+Peak memory is the resident weights plus an analytic estimate of the
+largest activations (UNet attention and the VAE decoder at full
+resolution), scaled by a factor fitted where the device reports its peak.
+"""
+import json
+import os
+import threading
+import time
+
+UNIT_PIXELS = 512 * 512
+
+# Weight given to each new observation in the running fits
+DECAY = 0.9
+
+
+def area_units(width, height):
+    return int(width) * int(height) / UNIT_PIXELS
+
+
+def module_bytes(*modules):
+    """Bytes held by the parameters, buffers and packed int8 weights of ``modules``."""
+    total = 0
+    for module in modules:
+        if module is None:
+            continue
+        tensors = list(module.parameters()) + list(module.buffers())
+        for child in module.modules():
+            # Dynamic int8 layers keep their weights in packed params, outside parameters()
+            if type(child).__name__ == "LinearPackedParams":
+                tensors.extend(t for t in child._weight_bias() if t is not None)
+        for tensor in tensors:
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class StepTimer:
+    """
+    Step callback that records per-step and decode timings of one batch.
+
+    Call ``start()`` before the batch and ``finish()`` after it returns.
+    """
+
+    def __init__(self):
+        self.started = None
+        self.step_ends = []
+
+    def start(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __call__(self, step, timestep, latents):
+        self.step_ends.append(time.perf_counter())
+
+    def finish(self):
+        """Return (seconds per step, decode seconds, total seconds), or None if unusable."""
+        end = time.perf_counter()
+        if self.started is None or len(self.step_ends) < 2:
+            return None
+        # The first step also pays for text encoding and latent setup
+        step_seconds = (self.step_ends[-1] - self.step_ends[0]) / (len(self.step_ends) - 1)
+        decode_seconds = end - self.step_ends[-1]
+        return step_seconds, decode_seconds, end - self.started
+
+
+class CostModel:
+    """
+    Predicts batch latency and peak memory from steps, size and batch size.
+
+    Args:
+        weights_bytes (int): Memory held by the loaded weights.
+        dtype_bytes (int): Bytes per activation element (2 for fp16/bf16).
+        quadratic_attention (bool): True when attention materialises the
+            full score matrix instead of using a memory-efficient kernel.
+    """
+
+    def __init__(self, weights_bytes=0, dtype_bytes=4, quadratic_attention=False):
+        self.weights_bytes = int(weights_bytes)
+        self.dtype_bytes = int(dtype_bytes)
+        self.quadratic_attention = quadratic_attention
+        # Rough CPU defaults, replaced as soon as batches are observed
+        self.step_base = 0.5
+        self.step_per_unit = 2.5
+        self.decode_per_unit = 4.0
+        self.overhead = 0.5
+        self.memory_scale = 1.0
+        self.samples = 0
+        self.source = "default"
+        # Decayed sums for the least-squares fit of step time against units * batch
+        self._sums = [0.0] * 5  # n, x, y, xx, xy
+        self._lock = threading.Lock()
+
+    def predict_seconds(self, steps, width, height, batch_size=1):
+        """Predicted wall time of one batch, from text encoding to decoded images."""
+        work = area_units(width, height) * int(batch_size)
+        with self._lock:
+            return (self.overhead
+                    + int(steps) * (self.step_base + self.step_per_unit * work)
+                    + self.decode_per_unit * work)
+
+    def activation_bytes(self, width, height, batch_size=1, attention_slicing=False,
+                         vae_slicing=False, vae_tiling=False):
+        """
+        Analytic estimate of the largest transient activations.
+
+        ``attention_slicing``, ``vae_slicing`` and ``vae_tiling`` model the
+        savings of the corresponding diffusers memory options.
+        """
+        b = int(batch_size)
+        tokens = (int(width) // 8) * (int(height) // 8)
+        # UNet at full latent resolution: 320 channels, run twice for guidance
+        unet = 2 * b * tokens * 320 * self.dtype_bytes * 12
+        if self.quadratic_attention:
+            # 8 heads of tokens x tokens scores; slicing computes one head at a time
+            heads = 1 if attention_slicing else 8
+            unet += 2 * b * heads * tokens * tokens * self.dtype_bytes
+        # VAE decoder up blocks at full resolution with 128-256 channels
+        pixels = int(width) * int(height)
+        if vae_tiling:
+            pixels = min(pixels, UNIT_PIXELS)
+        decode_batch = 1 if vae_slicing or vae_tiling else b
+        vae = decode_batch * pixels * 256 * self.dtype_bytes * 3
+        if self.quadratic_attention and not vae_tiling:
+            # Single-head attention in the VAE mid block, at latent resolution
+            vae += decode_batch * tokens * tokens * self.dtype_bytes
+        return max(unet, vae)
+
+    def predict_peak_bytes(self, width, height, batch_size=1, **options):
+        with self._lock:
+            scale = self.memory_scale
+        return int(self.weights_bytes + scale * self.activation_bytes(width, height, batch_size, **options))
+
+    def observe(self, steps, width, height, batch_size, step_seconds, decode_seconds, total_seconds):
+        """Fold the timings of one finished batch into the model."""
+        work = area_units(width, height) * int(batch_size)
+        with self._lock:
+            sums = [DECAY * value for value in self._sums]
+            for i, value in enumerate((1.0, work, step_seconds, work * work, work * step_seconds)):
+                sums[i] += value
+            self._sums = sums
+            n, sx, sy, sxx, sxy = sums
+            variance = n * sxx - sx * sx
+            if variance > 1e-9 * n * n:
+                self.step_per_unit = max(0.0, (n * sxy - sx * sy) / variance)
+                self.step_base = max(0.0, (sy - self.step_per_unit * sx) / n)
+            else:
+                # One shape seen so far: attribute the step time to the work done
+                self.step_base = 0.0
+                self.step_per_unit = sy / sx
+            weight = 1.0 if self.samples == 0 else 1 - DECAY
+            self.decode_per_unit += weight * (decode_seconds / work - self.decode_per_unit)
+            overhead = total_seconds - int(steps) * step_seconds - decode_seconds
+            self.overhead += weight * (max(0.0, overhead) - self.overhead)
+            self.samples += 1
+            if self.source == "default":
+                self.source = "observed"
+
+    def observe_memory(self, width, height, batch_size, peak_activation_bytes, **options):
+        """Fit the memory scale to a measured peak (bytes above the resident weights)."""
+        predicted = self.activation_bytes(width, height, batch_size, **options)
+        if predicted <= 0 or peak_activation_bytes <= 0:
+            return
+        with self._lock:
+            self.memory_scale += (1 - DECAY) * (peak_activation_bytes / predicted - self.memory_scale)
+
+    def state(self):
+        with self._lock:
+            return {
+                "source": self.source,
+                "samples": self.samples,
+                "overhead": round(self.overhead, 4),
+                "step_base": round(self.step_base, 4),
+                "step_per_unit": round(self.step_per_unit, 4),
+                "decode_per_unit": round(self.decode_per_unit, 4),
+                "memory_scale": round(self.memory_scale, 3),
+                "weights_bytes": self.weights_bytes,
+            }
+
+    def save(self, path):
+        state = self.state()
+        state["sums"] = list(self._sums)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Load coefficients from a calibration file; returns False if it is missing."""
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            for key in ("overhead", "step_base", "step_per_unit", "decode_per_unit", "memory_scale"):
+                if key in state:
+                    setattr(self, key, float(state[key]))
+            self._sums = [float(value) for value in state.get("sums", self._sums)]
+            self.samples = int(state.get("samples", 0))
+            self.source = f"file:{path}"
+        return True
@@ -0,0 +1,109 @@
+"""
+Cache of CLIP text encoder outputs.
+
+Most traffic shares the same negative prompt and many prompts repeat, so
+text embeddings are cached by exact text and reused across requests. Keys
+include a fingerprint of the text encoder and LoRA weights so a change of
+weights never serves stale embeddings.
+"""
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class PromptEmbeddingCache:
+    """
+    LRU cache of ``prompt_embeds`` keyed by (fingerprint, text).
+
+    Args:
+        pipe: StableDiffusionPipeline whose text encoder produces the embeddings.
+        max_entries (int): Maximum number of cached texts, excluding pinned ones.
+        fingerprint (str): Identifies the text encoder and LoRA weights.
+    """
+
+    def __init__(self, pipe, max_entries=128, fingerprint=""):
+        self.pipe = pipe
+        self.max_entries = max(0, int(max_entries))
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def bind(self, pipe, fingerprint):
+        """Point the cache at another pipeline instance with the given weights."""
+        with self._lock:
+            self.pipe = pipe
+            self.fingerprint = fingerprint
+            # Pinned entries for other weights would never be used again
+            self._pinned = {k: v for k, v in self._pinned.items() if k[0] == fingerprint}
+
+    def precompute(self, text, pin=True):
+        """Encode ``text`` now; pinned entries are never evicted."""
+        embeds = self.encode([text])[0]
+        if pin:
+            with self._lock:
+                self._pinned[(self.fingerprint, text)] = embeds
+        return embeds
+
+    def encode(self, texts, fingerprint=None):
+        """
+        Return stacked embeddings for ``texts``, encoding only cache misses.
+
+        ``fingerprint`` overrides the cache's own, e.g. while an adapter
+        that changes the text encoder is active.
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            fingerprint = fingerprint or self.fingerprint
+            for text in dict.fromkeys(texts):
+                key = (fingerprint, text)
+                embeds = self._pinned.get(key)
+                if embeds is None:
+                    embeds = self._entries.get(key)
+                    if embeds is not None:
+                        self._entries.move_to_end(key)
+                if embeds is None:
+                    missing.append(text)
+                else:
+                    found[text] = embeds
+            misses = sum(1 for text in texts if text not in found)
+            self.misses += misses
+            self.hits += len(texts) - misses
+
+        if missing:
+            with torch.inference_mode():
+                encoded, _ = self.pipe.encode_prompt(missing, self.pipe.device, 1, False)
+            with self._lock:
+                for text, embeds in zip(missing, encoded):
+                    # Clone so each entry does not keep the whole batch alive
+                    embeds = embeds.clone()
+                    found[text] = embeds
+                    self._store((fingerprint, text), embeds)
+
+        return torch.stack([found[text] for text in texts])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "pinned": len(self._pinned),
+            }
+
+    def _store(self, key, embeds):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = embeds
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,131 @@
+"""
+Batched Stable Diffusion inference.
+
+Runs one denoising loop over several requests that share the same shape
+parameters (steps, width, height, scheduler) while keeping prompts,
+negative prompts, guidance scales and seeds per request.
+"""
+import time
+from contextlib import nullcontext
+
+import torch
+
+try:
+    from pipeline.schedulers import step_kwargs
+except ImportError:  # Run as a script from inside pipeline/
+    from schedulers import step_kwargs
+
+
+def make_generator(seed=None):
+    """Create a CPU generator for one image, returning (generator, seed)."""
+    generator = torch.Generator(device="cpu")
+    if seed is None:
+        seed = generator.seed()
+    else:
+        generator.manual_seed(int(seed))
+    return generator, seed
+
+
+def prepare_latents(pipe, generators, width, height, dtype, device):
+    """Draw the initial noise for each image from its own generator."""
+    shape = (
+        1,
+        pipe.unet.config.in_channels,
+        height // pipe.vae_scale_factor,
+        width // pipe.vae_scale_factor,
+    )
+    # Noise is drawn on CPU so a seed gives the same image on every device
+    latents = torch.cat([
+        torch.randn(shape, generator=generator, device="cpu", dtype=dtype)
+        for generator in generators
+    ]).to(device)
+    return latents
+
+
+def generate_batch(pipe, prompts, negative_prompts, guidance_scales, generators,
+                   steps=20, width=512, height=512, embedding_cache=None,
+                   metrics=None, step_callback=None, embedding_fingerprint=None,
+                   scheduler=None):
+    """
+    Generate one image per prompt in a single batched denoising loop.
+
+    Args:
+        pipe: Loaded StableDiffusionPipeline.
+        prompts (list[str]): Prompt per image.
+        negative_prompts (list[str]): Negative prompt per image.
+        guidance_scales (list[float]): Classifier-free guidance per image.
+        generators (list[torch.Generator]): Noise generator per image.
+        steps (int): Number of denoising steps shared by the batch.
+        width (int): Output width shared by the batch.
+        height (int): Output height shared by the batch.
+        embedding_cache (PromptEmbeddingCache): Optional cache of text
+            encoder outputs.
+        embedding_fingerprint (str): Overrides the cache fingerprint when the
+            active adapter changes the text encoder.
+        metrics (Metrics): Optional registry for per-stage timings.
+        step_callback (callable): Called as ``step_callback(step, timestep,
+            latents)`` after every denoising step.
+        scheduler: Scheduler with timesteps already set, e.g. from
+            ``SchedulerRegistry.get``. Defaults to ``pipe.scheduler``.
+
+    Returns:
+        list[PIL.Image.Image]: Images in the same order as ``prompts``.
+    """
+    device = pipe.device
+    dtype = pipe.unet.dtype
+    batch_size = len(prompts)
+
+    def stage(name):
+        return metrics.time(name) if metrics is not None else nullcontext()
+
+    with torch.inference_mode():
+        with stage("text_encode"):
+            if embedding_cache is not None:
+                prompt_embeds = embedding_cache.encode(prompts, embedding_fingerprint)
+                negative_embeds = embedding_cache.encode(negative_prompts, embedding_fingerprint)
+            else:
+                prompt_embeds, negative_embeds = pipe.encode_prompt(
+                    prompts,
+                    device,
+                    1,
+                    True,
+                    negative_prompt=negative_prompts,
+                )
+        # Unconditional first, matching the order used by diffusers
+        embeds = torch.cat([negative_embeds, prompt_embeds])
+
+        if scheduler is None:
+            scheduler = pipe.scheduler
+            scheduler.set_timesteps(steps, device=device)
+        extra_step_kwargs = step_kwargs(scheduler, generators)
+        latents = prepare_latents(pipe, generators, width, height, dtype, device)
+        latents = latents * scheduler.init_noise_sigma
+
+        guidance = torch.tensor(guidance_scales, device=device, dtype=dtype)
+        guidance = guidance.view(batch_size, 1, 1, 1)
+
+        loop_start = time.perf_counter()
+        for i, t in enumerate(scheduler.timesteps):
+            step_start = time.perf_counter()
+            latent_input = torch.cat([latents] * 2)
+            latent_input = scheduler.scale_model_input(latent_input, t)
+            noise_pred = pipe.unet(latent_input, t, encoder_hidden_states=embeds).sample
+            noise_uncond, noise_text = noise_pred.chunk(2)
+            noise_pred = noise_uncond + guidance * (noise_text - noise_uncond)
+            latents = scheduler.step(noise_pred, t, latents, **extra_step_kwargs).prev_sample
+            if metrics is not None:
+                metrics.observe_stage("denoise_step", time.perf_counter() - step_start)
+            if step_callback is not None:
+                step_callback(i, t, latents)
+
+        if metrics is not None:
+            metrics.set("steps_per_second", steps / (time.perf_counter() - loop_start),
+                        help_text="Denoising steps per second in the last batch")
+            metrics.inc("denoise_steps_total", steps * batch_size,
+                        help_text="Denoising steps run, counted per image")
+
+        with stage("vae_decode"):
+            image = pipe.vae.decode(latents / pipe.vae.config.scaling_factor).sample
+            images = pipe.image_processor.postprocess(image, output_type="pil")
+
+    return images
@@ -0,0 +1,425 @@
+"""
+Asynchronous generation jobs.
+
+Wraps the batch scheduler with a bounded queue so callers can submit work,
+poll its status and fetch the result later instead of holding a connection
+open for the whole generation.
+
+Identical seeded requests are single-flighted: while one is generating,
+later copies attach to it as followers and receive the same image instead
+of generating it again.
+"""
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import InvalidStateError
+
+from pipeline.batching import GenerationCancelled
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has reached its configured depth."""
+
+    def __init__(self, retry_after):
+        super().__init__("Generation queue is full, retry later")
+        self.retry_after = retry_after
+
+
+class Job:
+    """A generation request tracked from submission to result."""
+
+    def __init__(self, gen_request, tracked=True, id_prefix=""):
+        self.id = id_prefix + uuid.uuid4().hex
+        self.request = gen_request
+        self.tracked = tracked
+        self.future = gen_request.future
+        self.created_at = time.time()
+        self.finished_at = None
+        # Cost reserved with the admission controller, returned when done
+        self.cost = 0.0
+        self.client = None
+        # Single-flight: the job generating this image for us, or the jobs waiting on ours
+        self.leader = None
+        self.followers = []
+        # Set when the caller gave up on a generation its followers still need
+        self.abandoned = None
+
+    @property
+    def status(self):
+        if self.abandoned is not None or self.future.cancelled():
+            return "cancelled"
+        if self.future.done():
+            error = self.future.exception()
+            if isinstance(error, GenerationCancelled):
+                return "cancelled"
+            return "failed" if error is not None else "done"
+        if self.request.cancel_reason() is not None:
+            return "cancelling"
+        if self.leader is not None:
+            return "running" if self.leader.request.started_at is not None else "queued"
+        if self.request.started_at is not None:
+            return "running"
+        return "queued"
+
+    def result(self):
+        if self.abandoned is not None:
+            raise GenerationCancelled(self.abandoned)
+        return self.future.result()
+
+    def error(self):
+        if self.abandoned is not None:
+            return str(GenerationCancelled(self.abandoned))
+        if self.future.cancelled():
+            return str(GenerationCancelled(self.request.cancel_reason() or "cancelled"))
+        if self.future.done():
+            e = self.future.exception()
+            return str(e) if e is not None else None
+        return None
+
+
+class JobQueue:
+    """
+    Bounded queue of jobs in front of a BatchScheduler.
+
+    Args:
+        batcher (BatchScheduler): Scheduler that runs the generations.
+        max_depth (int): Maximum number of unfinished jobs.
+        result_ttl (float): Seconds a finished job's result is kept.
+        cache (ResultCache): Optional cache consulted before queueing.
+        admission (AdmissionController): Optional cost-based admission.
+        cost_fn (callable): Cost of one GenerationRequest, for ``admission``.
+        estimate_fn (callable): Predicted seconds for a batch, called as
+            ``estimate_fn(steps, width, height, batch_size)``; without it
+            ETAs use a running average of batch durations.
+        id_prefix (str): Prepended to job IDs, e.g. to tell which worker
+            process owns a job.
+        on_coalesced (callable): Called with the number of requests that
+            attached to an identical in-flight generation.
+        encoder (EncoderPool): Encodes results for ``cache``; without it
+            they are encoded on the thread that finishes the job, i.e. the
+            batcher's.
+    """
+
+    def __init__(self, batcher, max_depth=32, result_ttl=600, cache=None,
+                 admission=None, cost_fn=None, estimate_fn=None, id_prefix="",
+                 on_coalesced=None, encoder=None):
+        self.batcher = batcher
+        self.encoder = encoder
+        self.on_coalesced = on_coalesced
+        self.id_prefix = id_prefix
+        self.cache = cache
+        self.admission = admission
+        self.cost_fn = cost_fn
+        self.estimate_fn = estimate_fn
+        self.max_depth = max(1, int(max_depth))
+        self.result_ttl = float(result_ttl)
+        self._active = OrderedDict()
+        self._finished = OrderedDict()
+        # Jobs attached to an identical generation; they add no work so do not count towards depth
+        self._followers = {}
+        # Result cache key -> job generating it
+        self._inflight = {}
+        # Result cache key -> finished image still being encoded for the cache
+        self._encoding = {}
+        self._lock = threading.Lock()
+        # Rolling average of how long one batch takes, seeded with a guess
+        self._avg_seconds = 30.0
+
+    def submit(self, gen_request, track=True, client=None):
+        """
+        Queue a request, raising QueueFullError if the queue is at capacity.
+
+        Untracked jobs count towards the queue depth but are not kept around
+        after they finish; synchronous endpoints use them.
+        """
+        return self.submit_many([gen_request], track=track, client=client)[0]
+
+    def submit_many(self, gen_requests, track=True, client=None):
+        """
+        Queue a group of requests together; either all are admitted or none.
+
+        ``client`` identifies the caller for per-client budgets.
+        """
+        jobs = []
+        queued = []
+        for gen_request in gen_requests:
+            cache_key = self.cache.key_for(gen_request) if self.cache is not None else None
+            image = self.cache.get(cache_key) if cache_key is not None else None
+            if image is None and cache_key is not None:
+                image = self._encoding.get(cache_key)
+            job = Job(gen_request, tracked=track, id_prefix=self.id_prefix)
+            job.client = client
+            if image is not None:
+                # Cache hits skip the queue entirely
+                job.future.set_result(image)
+                job.finished_at = time.time()
+            else:
+                queued.append((job, cache_key))
+            jobs.append(job)
+
+        with self._lock:
+            self._expire()
+            # Copies of a generation already in flight (or earlier in this group) wait for it
+            run, attach, leaders = [], [], {}
+            for job, cache_key in queued:
+                leader = self._leader_for(cache_key, job.request, leaders)
+                if leader is not None:
+                    attach.append((job, leader))
+                else:
+                    run.append((job, cache_key))
+                    if cache_key is not None:
+                        leaders[cache_key] = job
+            if run and len(self._active) + len(run) > self.max_depth:
+                raise QueueFullError(self._retry_after())
+            if self.admission is not None and run:
+                for job, _ in run:
+                    job.cost = self.cost_fn(job.request)
+                # Cache hits and followers are free; only work that will run is charged
+                self.admission.admit(client, sum(job.cost for job, _ in run), self._retry_after())
+            for job in jobs:
+                if job.future.done():
+                    if track:
+                        self._finished[job.id] = job
+            for job, cache_key in run:
+                self._active[job.id] = job
+                if cache_key is not None:
+                    self._inflight[cache_key] = job
+            for job, leader in attach:
+                job.leader = leader
+                leader.followers.append(job)
+                self._followers[job.id] = job
+
+        for job, cache_key in run:
+            job.future.add_done_callback(lambda _, job=job, key=cache_key: self._on_done(job, key))
+        for job, _ in attach:
+            job.future.add_done_callback(lambda _, job=job: self._on_follower_done(job))
+        if attach and self.on_coalesced is not None:
+            self.on_coalesced(len(attach))
+        self.batcher.submit_many([job.request for job, _ in run])
+        return jobs
+
+    def _leader_for(self, cache_key, gen_request, leaders):
+        """The in-flight job ``gen_request`` can share, or None to generate it separately."""
+        # Only seeded requests are reproducible; preview streams need their own denoising loop
+        if cache_key is None or gen_request.preview_every:
+            return None
+        leader = leaders.get(cache_key) or self._inflight.get(cache_key)
+        if leader is None or leader.future.done() or leader.request.cancel_reason() is not None:
+            return None
+        # A follower must not wait past its own deadline for a leader with a later one
+        deadline = gen_request.deadline
+        if deadline is not None and (leader.request.deadline is None or leader.request.deadline > deadline):
+            return None
+        return leader
+
+    def cancel(self, job, reason="cancelled"):
+        """
+        Cancel a job; returns False if it had already finished.
+
+        A leader whose followers are still waiting is detached instead: its
+        generation runs on for them and only this job reports cancelled.
+        """
+        with self._lock:
+            if job.abandoned is not None:
+                return False
+            if not job.future.done() and any(not follower.future.done() for follower in job.followers):
+                job.abandoned = reason
+                return True
+        return job.request.cancel(reason)
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            return self._active.get(job_id) or self._followers.get(job_id) or self._finished.get(job_id)
+
+    def depth(self):
+        with self._lock:
+            return len(self._active)
+
+    def position(self, job):
+        """Number of queued jobs ahead of ``job`` (0 once it is running)."""
+        job = job.leader or job
+        if job.status != "queued":
+            return 0
+        with self._lock:
+            ahead = 0
+            for other in self._active.values():
+                if other is job:
+                    break
+                if other.request.started_at is None:
+                    ahead += 1
+            return ahead
+
+    def eta(self, job):
+        """Rough number of seconds until ``job`` finishes."""
+        job = job.leader or job
+        status = job.status
+        if status not in ("queued", "running"):
+            return 0.0
+        if self.estimate_fn is None:
+            if status == "running":
+                elapsed = time.monotonic() - job.request.started_at
+                return max(0.0, self._avg_seconds - elapsed)
+            batches_ahead = self.position(job) // self.batcher.max_batch_size
+            return (batches_ahead + 1) * self._avg_seconds
+        if status == "running":
+            return self._remaining(job.request)
+        with self._lock:
+            active = list(self._active.values())
+        return self.backlog_seconds(active[:active.index(job) + 1] if job in active else [job])
+
+    def backlog_seconds(self, jobs=None):
+        """
+        Predicted seconds to finish ``jobs`` (default: every unfinished job),
+        counting running batches once and queued jobs in batches of
+        compatible requests.
+        """
+        if jobs is None:
+            with self._lock:
+                jobs = list(self._active.values())
+        seconds = 0.0
+        running = set()
+        groups = {}
+        for job in jobs:
+            r = job.request
+            if r.started_at is not None:
+                if r.started_at not in running:
+                    running.add(r.started_at)
+                    seconds += self._remaining(r)
+            elif not job.future.done():
+                groups.setdefault(r.batch_key(), []).append(r)
+        max_batch = self.batcher.max_batch_size
+        for requests in groups.values():
+            r = requests[0]
+            full, rest = divmod(len(requests), max_batch)
+            seconds += full * self.estimate_fn(r.steps, r.width, r.height, max_batch)
+            if rest:
+                seconds += self.estimate_fn(r.steps, r.width, r.height, rest)
+        return seconds
+
+    def _remaining(self, r):
+        elapsed = time.monotonic() - r.started_at
+        return max(0.0, self.estimate_fn(r.steps, r.width, r.height, r.batch_size) - elapsed)
+
+    def describe(self, job):
+        """JSON-serialisable status of a job."""
+        info = {
+            "job_id": job.id,
+            "status": job.status,
+            "seed": job.request.seed,
+            "position": self.position(job),
+            "eta_seconds": round(self.eta(job), 1),
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+        }
+        error = job.error()
+        if error:
+            info["error"] = error
+        return info
+
+    def _retry_after(self):
+        batches = math.ceil(len(self._active) / self.batcher.max_batch_size)
+        return max(1, math.ceil(batches * self._avg_seconds))
+
+    def _on_done(self, job, cache_key=None):
+        job.finished_at = time.time()
+        if self.admission is not None:
+            self.admission.release(job.cost)
+        # Judged by the generation, not the job: an abandoned leader still produced an image
+        succeeded = not job.future.cancelled() and job.future.exception() is None
+        if cache_key is not None and succeeded:
+            self._cache_result(cache_key, job.future.result())
+        with self._lock:
+            self._active.pop(job.id, None)
+            # Cancelled runs stop early and would drag the average down
+            if job.request.started_at is not None and succeeded:
+                duration = time.monotonic() - job.request.started_at
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * duration
+            if job.tracked:
+                self._finished[job.id] = job
+            if cache_key is not None and self._inflight.get(cache_key) is job:
+                del self._inflight[cache_key]
+            followers = [follower for follower in job.followers if not follower.future.done()]
+            job.followers = []
+        if followers:
+            self._settle_followers(job, cache_key, followers)
+
+    def _cache_result(self, cache_key, image):
+        if self.encoder is None:
+            self.cache.put(cache_key, image)
+            return
+
+        def store(future):
+            if future.exception() is not None:
+                print(f"Failed to encode cache entry {cache_key}: {future.exception()}")
+            else:
+                self.cache.put_encoded(cache_key, future.result()[0])
+            self._encoding.pop(cache_key, None)
+
+        # Identical requests arriving meanwhile are served from here
+        self._encoding[cache_key] = image
+        self.encoder.submit(image, "png").add_done_callback(store)
+
+    def _settle_followers(self, leader, cache_key, followers):
+        """Pass the leader's outcome on, or re-run the generation if only the leader gave up."""
+        if not leader.future.cancelled() and not isinstance(leader.future.exception(), GenerationCancelled):
+            for follower in followers:
+                try:
+                    if leader.future.exception() is not None:
+                        follower.future.set_exception(leader.future.exception())
+                    else:
+                        follower.future.set_result(leader.future.result())
+                except InvalidStateError:
+                    # The follower was cancelled in the meantime
+                    pass
+            return
+        # The first follower becomes the new leader and runs as a normal job
+        job, rest = followers[0], followers[1:]
+        if self.admission is not None:
+            job.cost = self.cost_fn(job.request)
+            try:
+                self.admission.admit(job.client, job.cost, self._retry_after())
+            except QueueFullError as e:
+                for follower in followers:
+                    try:
+                        follower.future.set_exception(e)
+                    except InvalidStateError:
+                        pass
+                return
+        with self._lock:
+            self._followers.pop(job.id, None)
+            job.leader = None
+            job.followers = rest
+            for follower in rest:
+                follower.leader = job
+            self._active[job.id] = job
+            if cache_key is not None:
+                self._inflight[cache_key] = job
+        job.future.add_done_callback(lambda _, job=job, key=cache_key: self._on_done(job, key))
+        self.batcher.submit(job.request)
+
+    def _on_follower_done(self, job):
+        if job.leader is None:
+            # Promoted to leader; _on_done does the bookkeeping
+            return
+        job.finished_at = time.time()
+        with self._lock:
+            self._followers.pop(job.id, None)
+            if job.tracked:
+                self._finished[job.id] = job
+            leader = job.leader
+            orphaned = leader.abandoned is not None and not any(
+                not follower.future.done() for follower in leader.followers)
+        if orphaned:
+            # The last follower gave up too, so nobody needs the generation any more
+            leader.request.cancel(leader.abandoned)
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        while self._finished:
+            job_id, job = next(iter(self._finished.items()))
+            if job.finished_at >= cutoff:
+                break
+            self._finished.pop(job_id)
@@ -0,0 +1,113 @@
+"""
+Serving a LoRA fused into the base weights.
+
+Unfused LoRA layers add two low-rank matmuls to every targeted projection
+on every step. Fusing merges ``scale * B @ A`` into the base weights once.
+When ``keep_lora`` is False the LoRA parameters are freed after fusing and
+only a CPU copy of the (small) state dict is kept; a later scale change
+reloads it and fuses only the difference between the new and the old scale.
+"""
+import threading
+
+from pipeline.adapters import load_state_dict
+
+
+class FusedLora:
+    """
+    Keeps one LoRA fused into ``pipe`` at a configurable scale.
+
+    Args:
+        pipe: StableDiffusionPipeline with the LoRA already loaded.
+        lora_dir (str): Directory the LoRA was loaded from, used to reload it.
+        scale (float): Scale to fuse at.
+        keep_lora (bool): Keep the LoRA layers so the scale can be changed
+            with an exact unfuse instead of a reload.
+        adapter_name (str): Name the LoRA was loaded under, if any.
+    """
+
+    def __init__(self, pipe, lora_dir, scale=1.0, keep_lora=False, adapter_name=None):
+        self.pipe = pipe
+        self.lora_dir = lora_dir
+        self.keep_lora = keep_lora
+        self.adapter_name = adapter_name
+        self.scale = None
+        self._lock = threading.Lock()
+        if keep_lora:
+            self._state_dict = None
+            if adapter_name is None:
+                self.adapter_name = pipe.get_active_adapters()[0]
+        else:
+            # Read before fusing, while the files still match what was loaded
+            self._state_dict = load_state_dict(lora_dir)
+        self.fuse(scale)
+
+    def _fuse_kwargs(self, scale):
+        kwargs = {"lora_scale": scale}
+        if self.adapter_name:
+            kwargs["adapter_names"] = [self.adapter_name]
+        return kwargs
+
+    def fuse(self, scale):
+        """Fuse at ``scale``, replacing whatever scale is currently fused."""
+        with self._lock:
+            scale = float(scale)
+            if self.scale is not None and scale == self.scale:
+                return
+            if self.scale is None:
+                self.pipe.fuse_lora(**self._fuse_kwargs(scale))
+            elif self.keep_lora:
+                self.pipe.unfuse_lora()
+                self.pipe.fuse_lora(**self._fuse_kwargs(scale))
+            else:
+                # W + old*BA + (new - old)*BA == W + new*BA
+                self.pipe.load_lora_weights(dict(self._state_dict), adapter_name=self.adapter_name)
+                self.pipe.fuse_lora(**self._fuse_kwargs(scale - self.scale))
+            if not self.keep_lora:
+                self.pipe.unload_lora_weights()
+            self.scale = scale
+
+    def replace(self, state_dict, validate, fingerprint, lora_dir=None):
+        """
+        Swap the fused LoRA for new weights once they pass validation.
+
+        The new weights are loaded as a shadow adapter and ``validate`` runs
+        a generation with them active. If it raises, the fused weights are
+        left as they were.
+        """
+        with self._lock:
+            shadow = f"lora@{fingerprint}"
+            if self.keep_lora:
+                # Back to the base weights, with the old LoRA still loaded beside the new one
+                self.pipe.unfuse_lora()
+                self.pipe.load_lora_weights(dict(state_dict), adapter_name=shadow)
+                self.pipe.set_adapters([shadow], adapter_weights=[self.scale])
+                try:
+                    validate()
+                except Exception:
+                    self.pipe.delete_adapters(shadow)
+                    self.pipe.set_adapters([self.adapter_name], adapter_weights=[1.0])
+                    self.pipe.fuse_lora(**self._fuse_kwargs(self.scale))
+                    raise
+                self.pipe.delete_adapters(self.adapter_name)
+                self.pipe.set_adapters([shadow], adapter_weights=[1.0])
+                self.adapter_name = shadow
+                self.pipe.fuse_lora(**self._fuse_kwargs(self.scale))
+            else:
+                # Layered on the fused weights: W + s*old - s*old + s*new == W + s*new
+                previous = "lora@previous"
+                self.pipe.load_lora_weights(dict(self._state_dict), adapter_name=previous)
+                self.pipe.load_lora_weights(dict(state_dict), adapter_name=shadow)
+                self.pipe.set_adapters([previous, shadow], adapter_weights=[-self.scale, self.scale])
+                try:
+                    validate()
+                except Exception:
+                    self.pipe.unload_lora_weights()
+                    raise
+                self.pipe.fuse_lora(lora_scale=1.0, adapter_names=[previous, shadow])
+                self.pipe.unload_lora_weights()
+                self._state_dict = state_dict
+            if lora_dir:
+                self.lora_dir = lora_dir
+
+    def state(self):
+        return {"fused": True, "scale": self.scale, "lora_params_resident": self.keep_lora}
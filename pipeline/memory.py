@@ -0,0 +1,127 @@
+"""
+Memory policy for large generations.
+
+VAE slicing, VAE tiling and attention slicing cut peak memory but cost
+time, so they are switched on per batch only when the cost model predicts
+the batch would not fit in the memory budget otherwise. The common 512x512
+case runs with all of them off.
+"""
+import os
+
+# Cheapest first: slicing only serialises the decode, tiling adds overlap
+# work and seams, attention slicing slows every step
+OPTION_LADDER = (
+    {},
+    {"vae_slicing": True},
+    {"vae_slicing": True, "vae_tiling": True},
+    {"vae_slicing": True, "vae_tiling": True, "attention_slicing": True},
+)
+
+OPTIONS = ("vae_slicing", "vae_tiling", "attention_slicing")
+
+
+class MemoryBudgetError(ValueError):
+    """Raised for a generation that cannot fit in the memory budget."""
+
+
+def _cgroup_limit():
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+
+def detect_memory_budget(device, fraction=0.85):
+    """Bytes the process may use: a fraction of GPU memory, or of RAM / the cgroup limit."""
+    if device == "cuda":
+        import torch
+        return int(torch.cuda.get_device_properties(0).total_memory * fraction)
+    total = None
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        pass
+    limit = _cgroup_limit()
+    if limit is not None:
+        total = min(total, limit) if total else limit
+    return int(total * fraction) if total else None
+
+
+class MemoryPolicy:
+    """
+    Picks and applies the cheapest memory options that fit a batch in budget.
+
+    Args:
+        pipe: StableDiffusionPipeline the options are applied to.
+        cost_model (CostModel): Provides peak memory predictions.
+        budget_bytes (int): Peak memory allowed, or None for no limit.
+        allow_attention_slicing (bool): False when swapping attention
+            processors would undo other optimizations (e.g. torch.compile).
+    """
+
+    def __init__(self, pipe, cost_model, budget_bytes=None, allow_attention_slicing=True):
+        self.pipe = pipe
+        self.cost_model = cost_model
+        self.budget_bytes = budget_bytes
+        self.ladder = [options for options in OPTION_LADDER
+                       if allow_attention_slicing or not options.get("attention_slicing")]
+        self.applied = {name: False for name in OPTIONS}
+        self.switches = 0
+
+    def plan(self, width, height, batch_size=1):
+        """Cheapest options predicted to fit, or None if nothing fits."""
+        for options in self.ladder:
+            if self.fits(width, height, batch_size, options):
+                return dict(options)
+        return None
+
+    def fits(self, width, height, batch_size=1, options=None):
+        if self.budget_bytes is None:
+            return True
+        peak = self.cost_model.predict_peak_bytes(width, height, batch_size, **(options or {}))
+        return peak <= self.budget_bytes
+
+    def check(self, width, height, batch_size=1):
+        """Raise MemoryBudgetError if even the most frugal options do not fit."""
+        if self.plan(width, height, batch_size) is None:
+            peak = self.cost_model.predict_peak_bytes(width, height, batch_size, **self.ladder[-1])
+            raise MemoryBudgetError(
+                f"{width}x{height} x{batch_size} needs about {peak / 2**30:.1f} GiB, "
+                f"over the {self.budget_bytes / 2**30:.1f} GiB memory budget; lower width, height or num_images"
+            )
+
+    def max_batch_size(self, width, height, limit):
+        """Largest batch up to ``limit`` that fits at this size (at least 1)."""
+        for batch_size in range(int(limit), 1, -1):
+            if self.plan(width, height, batch_size) is not None:
+                return batch_size
+        return 1
+
+    def apply(self, options):
+        """Switch the pipeline to ``options``, touching only what changes."""
+        for name in OPTIONS:
+            wanted = bool(options.get(name))
+            if wanted == self.applied[name]:
+                continue
+            if name == "vae_slicing":
+                self.pipe.vae.enable_slicing() if wanted else self.pipe.vae.disable_slicing()
+            elif name == "vae_tiling":
+                self.pipe.vae.enable_tiling() if wanted else self.pipe.vae.disable_tiling()
+            elif wanted:
+                self.pipe.enable_attention_slicing()
+            else:
+                self.pipe.disable_attention_slicing()
+            self.applied[name] = wanted
+            self.switches += 1
+
+    def state(self):
+        return {
+            "budget_bytes": self.budget_bytes,
+            "applied": {name: value for name, value in self.applied.items() if value},
+            "switches": self.switches,
+        }
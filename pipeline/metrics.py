@@ -0,0 +1,154 @@
+"""
+Lightweight metrics in the Prometheus text exposition format.
+
+Recording a value is a lock and an addition; all formatting happens when
+``/metrics`` is scraped, so the cost is negligible when nobody is watching.
+"""
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def process_rss_bytes():
+    """Current resident set size, falling back to the peak where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Metrics:
+    """
+    Registry of counters, gauges and histograms.
+
+    Args:
+        namespace (str): Prefix added to every metric name.
+    """
+
+    def __init__(self, namespace="pottery"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_fns = {}
+        self._histograms = {}
+
+    def _name(self, name):
+        return f"{self.namespace}_{name}"
+
+    def _register(self, name, kind, help_text):
+        if name not in self._types:
+            self._types[name] = kind
+            self._help[name] = help_text or name
+
+    def inc(self, name, value=1, help_text=None, **labels):
+        """Increase a counter."""
+        name = self._name(name)
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._register(name, "counter", help_text)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, help_text=None, **labels):
+        """Set a gauge to ``value``."""
+        name = self._name(name)
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._register(name, "gauge", help_text)
+            self._gauges.setdefault(name, {})[key] = value
+
+    def gauge_fn(self, name, fn, help_text=None):
+        """Register a gauge whose value (or {labels: value} dict) is read at scrape time."""
+        name = self._name(name)
+        with self._lock:
+            self._register(name, "gauge", help_text)
+            self._gauge_fns[name] = fn
+
+    def observe(self, name, value, help_text=None, buckets=DEFAULT_BUCKETS, **labels):
+        """Record one observation in a histogram."""
+        name = self._name(name)
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._register(name, "histogram", help_text)
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(hist["buckets"]):
+                if value <= bound:
+                    hist["counts"][i] += 1
+                    break
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def observe_stage(self, stage, seconds):
+        self.observe("stage_duration_seconds", seconds,
+                     help_text="Time spent in each generation stage", stage=stage)
+
+    @contextmanager
+    def time(self, stage):
+        """Time the enclosed block as one observation of ``stage``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    def render(self):
+        """Format every metric in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            gauge_fns = dict(self._gauge_fns)
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+            histograms = {
+                name: {key: dict(h, counts=list(h["counts"])) for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+            types = dict(self._types)
+            helps = dict(self._help)
+
+        for name, fn in gauge_fns.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if isinstance(value, dict):
+                # Keys are label tuples such as (("cache", "result"),)
+                gauges[name] = dict(value)
+            elif value is not None:
+                gauges[name] = {(): value}
+
+        for name in sorted(types):
+            lines.append(f"# HELP {name} {helps[name]}")
+            lines.append(f"# TYPE {name} {types[name]}")
+            for series in (counters.get(name), gauges.get(name)):
+                for key, value in (series or {}).items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for key, hist in (histograms.get(name) or {}).items():
+                cumulative = 0
+                for bound, count in zip(hist["buckets"], hist["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {hist['count']}")
+                lines.append(f"{name}_sum{_format_labels(key)} {hist['sum']}")
+                lines.append(f"{name}_count{_format_labels(key)} {hist['count']}")
+        return "\n".join(lines) + "\n"
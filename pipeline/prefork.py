@@ -0,0 +1,282 @@
+"""
+Pre-fork serving.
+
+The pipeline is loaded once in the supervisor process, then N worker
+processes are forked from it. Weights are never written after loading, so
+the workers share their memory pages copy-on-write and N workers cost
+little more RAM than one. Every worker accepts connections on the same
+listening socket; the supervisor restarts workers that exit or stop
+sending heartbeats and records what happened in a status directory that
+any worker can report from.
+
+Only the supervisor's main thread may exist at fork time: threads, and
+any locks they hold, do not survive a fork. Loading is not thread-free by
+itself: LoRA fusion, quantization and memory-format conversion are
+parallel torch ops that start the OpenMP pool, which hangs a forked child
+that uses it. The supervisor therefore loads with one intra-op thread,
+and everything else that starts threads (the batcher, watchers,
+inference) belongs in the worker, after the fork.
+"""
+import gc
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+
+def _write_json(path, payload):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def process_memory():
+    """
+    Resident, proportional and shared bytes of this process from /proc.
+
+    PSS splits each shared page between the processes mapping it, so the
+    PSS of all workers adds up to the host's real memory use.
+    """
+    fields = {"Rss": "rss_bytes", "Pss": "pss_bytes", "Shared_Clean": "shared_bytes",
+              "Shared_Dirty": "shared_bytes"}
+    memory = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    key = fields[name]
+                    memory[key] = memory.get(key, 0) + int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return memory
+
+
+def listen_socket(host, port, backlog=128):
+    """Bind the listening socket every worker accepts on."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Heartbeat:
+    """
+    Thread in a worker that writes its status file every ``interval`` seconds.
+
+    Args:
+        status_dir (str): Directory shared with the supervisor.
+        index (int): Worker slot number.
+        state_fn (callable): Returns a JSON-serialisable dict merged into
+            each heartbeat.
+        interval (float): Seconds between heartbeats.
+    """
+
+    def __init__(self, status_dir, index, state_fn=None, interval=5.0):
+        self.path = os.path.join(status_dir, f"worker-{index}.json")
+        self.index = index
+        self.state_fn = state_fn
+        self.interval = float(interval)
+        self.started_at = time.time()
+        self._stop = threading.Event()
+
+    def start(self):
+        self.beat()
+        threading.Thread(target=self._loop, name="heartbeat", daemon=True).start()
+        return self
+
+    def beat(self):
+        payload = {"index": self.index, "pid": os.getpid(), "started_at": self.started_at,
+                   "heartbeat_at": time.time()}
+        if self.state_fn is not None:
+            try:
+                payload.update(self.state_fn())
+            except Exception as e:
+                payload["state_error"] = str(e)
+        _write_json(self.path, payload)
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.beat()
+
+
+class Supervisor:
+    """
+    Forks and babysits worker processes.
+
+    Args:
+        num_workers (int): Worker processes to keep running.
+        run_worker (callable): ``run_worker(index)`` runs in the child and
+            serves until the process should exit.
+        status_dir (str): Where workers write heartbeats and the supervisor
+            writes its own state.
+        heartbeat_timeout (float): A worker whose last heartbeat is older
+            than this is killed and restarted; 0 disables the check.
+        max_restart_delay (float): Cap on the backoff between restarts of a
+            worker that keeps crashing.
+    """
+
+    def __init__(self, num_workers, run_worker, status_dir, heartbeat_timeout=120.0,
+                 max_restart_delay=30.0):
+        self.num_workers = max(1, int(num_workers))
+        self.run_worker = run_worker
+        self.status_dir = status_dir
+        self.heartbeat_timeout = float(heartbeat_timeout)
+        self.max_restart_delay = float(max_restart_delay)
+        self.workers = {}
+        self._stopping = False
+        os.makedirs(status_dir, exist_ok=True)
+
+    def run(self):
+        """Fork the workers and supervise them until SIGTERM or SIGINT."""
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        # Keep the garbage collector from touching (and so copying) every
+        # object page the workers inherit
+        gc.collect()
+        gc.freeze()
+        for index in range(self.num_workers):
+            self.workers[index] = {"pid": None, "restarts": 0, "started_at": None,
+                                   "last_exit": None, "restart_at": 0.0, "delay": 1.0}
+            self._spawn(index)
+        while not self._stopping:
+            self._reap()
+            self._check_heartbeats()
+            self._restart_due()
+            self._write_state()
+            time.sleep(0.5)
+        self._shutdown()
+
+    def _spawn(self, index):
+        worker = self.workers[index]
+        try:
+            os.remove(os.path.join(self.status_dir, f"worker-{index}.json"))
+        except OSError:
+            pass
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                self.run_worker(index)
+            except BaseException as e:
+                print(f"Worker {index} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        worker.update(pid=pid, started_at=time.time())
+        print(f"Started worker {index} (pid {pid})")
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for index, worker in self.workers.items():
+                if worker["pid"] != pid:
+                    continue
+                code = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+                uptime = time.time() - worker["started_at"]
+                # Back off for workers that die soon after starting
+                worker["delay"] = min(self.max_restart_delay, worker["delay"] * 2) if uptime < 60 else 1.0
+                worker.update(pid=None, last_exit={"code": code, "at": time.time(), "uptime": round(uptime, 1)},
+                              restart_at=time.time() + worker["delay"])
+                print(f"Worker {index} (pid {pid}) exited with {code}, restarting in {worker['delay']:.0f}s")
+
+    def _check_heartbeats(self):
+        if not self.heartbeat_timeout:
+            return
+        now = time.time()
+        for index, worker in self.workers.items():
+            if worker["pid"] is None or now - worker["started_at"] < self.heartbeat_timeout:
+                continue
+            beat = _read_json(os.path.join(self.status_dir, f"worker-{index}.json")) or {}
+            if now - beat.get("heartbeat_at", 0) > self.heartbeat_timeout:
+                print(f"Worker {index} (pid {worker['pid']}) missed its heartbeat, killing it")
+                try:
+                    os.kill(worker["pid"], signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _restart_due(self):
+        now = time.time()
+        for index, worker in self.workers.items():
+            if worker["pid"] is None and now >= worker["restart_at"]:
+                worker["restarts"] += 1
+                self._spawn(index)
+
+    def _write_state(self):
+        _write_json(os.path.join(self.status_dir, "supervisor.json"), {
+            "pid": os.getpid(),
+            "workers": {str(index): {key: value for key, value in worker.items() if key != "restart_at"}
+                        for index, worker in self.workers.items()},
+            "updated_at": time.time(),
+        })
+
+    def _on_signal(self, signum, frame):
+        self._stopping = True
+
+    def _shutdown(self, timeout=10.0):
+        pids = [worker["pid"] for worker in self.workers.values() if worker["pid"] is not None]
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + timeout
+        while pids and time.time() < deadline:
+            pids = [pid for pid in pids if not self._exited(pid)]
+            time.sleep(0.1)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    @staticmethod
+    def _exited(pid):
+        try:
+            return os.waitpid(pid, os.WNOHANG)[0] != 0
+        except ChildProcessError:
+            return True
+
+
+def worker_states(status_dir, heartbeat_timeout=120.0):
+    """Supervisor bookkeeping merged with each worker's latest heartbeat."""
+    supervisor = _read_json(os.path.join(status_dir, "supervisor.json")) or {"workers": {}}
+    now = time.time()
+    workers = []
+    for index, worker in sorted(supervisor["workers"].items(), key=lambda item: int(item[0])):
+        beat = _read_json(os.path.join(status_dir, f"worker-{index}.json")) or {}
+        alive = worker.get("pid") is not None and beat.get("pid") == worker.get("pid")
+        age = now - beat["heartbeat_at"] if alive else None
+        workers.append(dict(
+            beat,
+            index=int(index),
+            pid=worker.get("pid"),
+            restarts=worker.get("restarts", 0),
+            last_exit=worker.get("last_exit"),
+            heartbeat_age=round(age, 1) if age is not None else None,
+            healthy=alive and (not heartbeat_timeout or age <= heartbeat_timeout),
+        ))
+    return {"supervisor_pid": supervisor.get("pid"), "workers": workers}
@@ -0,0 +1,69 @@
+"""
+Dynamic int8 quantization for CPU serving.
+
+The linear layers of the UNet (attention projections and feed-forwards)
+and of the CLIP text encoder are replaced by dynamically quantized int8
+layers. Quantization must run after the LoRA has been fused into the base
+weights. The quantized state dicts are cached on disk so later startups
+only rebuild the module structure and load the packed weights.
+"""
+import os
+
+import torch
+from torch import nn
+
+QUANTIZED_COMPONENTS = ("unet", "text_encoder")
+
+
+def quantize_module(module):
+    """Replace every nn.Linear in ``module`` with a dynamic int8 Linear, in place."""
+    torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return module
+
+
+def _swap_linear_layers(module):
+    """Replace nn.Linear layers with empty int8 layers ready for load_state_dict."""
+    for name, child in module.named_children():
+        # Exact type, as quantize_dynamic matches it: subclasses such as
+        # LoRA-wrapped layers are left alone there and must be here too
+        if type(child) is nn.Linear:
+            quantized = torch.ao.nn.quantized.dynamic.Linear(
+                child.in_features,
+                child.out_features,
+                bias_=child.bias is not None,
+                dtype=torch.qint8,
+            )
+            setattr(module, name, quantized)
+        else:
+            _swap_linear_layers(child)
+    return module
+
+
+def quantize_pipeline(pipe, cache_path=None):
+    """
+    Quantize the UNet and text encoder of ``pipe`` in place.
+
+    Args:
+        pipe: CPU StableDiffusionPipeline with any LoRA already fused.
+        cache_path (str): File holding the quantized state dicts. It is
+            loaded when present and written after quantizing otherwise.
+
+    Returns:
+        bool: True if the weights came from the cache.
+    """
+    if cache_path and os.path.exists(cache_path):
+        state = torch.load(cache_path, map_location="cpu", weights_only=False)
+        for component in QUANTIZED_COMPONENTS:
+            module = _swap_linear_layers(getattr(pipe, component))
+            module.load_state_dict(state[component])
+        return True
+
+    for component in QUANTIZED_COMPONENTS:
+        quantize_module(getattr(pipe, component))
+
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        torch.save({c: getattr(pipe, c).state_dict() for c in QUANTIZED_COMPONENTS}, tmp_path)
+        os.replace(tmp_path, cache_path)
+    return False
@@ -0,0 +1,110 @@
+"""
+Hot reload of LoRA weights from disk.
+
+``LoraWatcher`` polls the weight files of each watched directory and calls
+back once a change has stopped changing, so a training run that is still
+writing its checkpoint is not picked up half-written. The swap itself is
+done by ``AdapterRegistry.replace`` or ``FusedLora.replace``: the new
+weights are loaded as a shadow adapter next to the serving ones, checked
+with ``check_image`` on a short generation, and only then take over.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from pipeline.adapters import WEIGHT_NAMES
+
+
+class ValidationError(RuntimeError):
+    """Raised when new weights produce an unusable validation image."""
+
+
+def weights_signature(path):
+    """Cheap change detector: (name, size, mtime) of each weight file."""
+    signature = []
+    for name in WEIGHT_NAMES:
+        file_path = os.path.join(path, name)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        signature.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def check_image(image):
+    """Reject validation images that are blank or flat, e.g. from NaN latents."""
+    pixels = np.asarray(image, dtype=np.float32)
+    if not np.isfinite(pixels).all():
+        raise ValidationError("validation image contains non-finite values")
+    if pixels.std() < 1.0:
+        raise ValidationError(f"validation image is flat (mean {pixels.mean():.1f})")
+
+
+class LoraWatcher:
+    """
+    Background thread that reports changed LoRA directories.
+
+    Args:
+        paths (callable): Returns the {name: directory} mapping to watch,
+            read on every poll so newly registered adapters are picked up.
+        on_change (callable): Called as ``on_change(name)`` from the
+            watcher thread once a directory's weights are stable.
+        interval (float): Seconds between polls.
+        settle (float): Seconds a change must stay unchanged before
+            ``on_change`` is called.
+    """
+
+    def __init__(self, paths, on_change, interval=10.0, settle=5.0):
+        self.paths = paths
+        self.on_change = on_change
+        self.interval = max(0.5, float(interval))
+        self.settle = max(0.0, float(settle))
+        self._known = {}
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for name, path in self.paths().items():
+            self._known[name] = weights_signature(path)
+        self._thread = threading.Thread(target=self._loop, name="lora-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def mark_current(self, name, path):
+        """Record ``path`` as loaded, e.g. after a reload through the admin endpoint."""
+        self._known[name] = weights_signature(path)
+        self._pending.pop(name, None)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            for name, path in self.paths().items():
+                self._poll(name, path)
+
+    def _poll(self, name, path):
+        signature = weights_signature(path)
+        if not signature or signature == self._known.get(name):
+            self._pending.pop(name, None)
+            return
+        now = time.monotonic()
+        seen_signature, seen_at = self._pending.get(name, (None, None))
+        if signature != seen_signature:
+            # Still being written; wait for it to settle
+            self._pending[name] = (signature, now)
+            return
+        if now - seen_at < self.settle:
+            return
+        self._pending.pop(name, None)
+        self._known[name] = signature
+        try:
+            self.on_change(name)
+        except Exception as e:
+            print(f"Reloading LoRA '{name}' from {path} failed: {e}")
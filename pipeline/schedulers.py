@@ -0,0 +1,129 @@
+"""
+Named noise schedulers selectable per request.
+
+Schedulers keep per-run state (the current step index, DPM++'s history of
+model outputs), so concurrent loops must not share an instance. Each thread
+gets its own instance per scheduler, and the tables ``set_timesteps``
+computes for a (scheduler, steps, device) triple are cached and copied back
+in instead of being recomputed for every batch.
+"""
+import inspect
+import threading
+
+from diffusers import (DDIMScheduler, DPMSolverMultistepScheduler, EulerDiscreteScheduler,
+                       LCMScheduler, UniPCMultistepScheduler)
+
+# name -> (scheduler class, config overrides)
+SCHEDULERS = {
+    "dpmpp_2m": (DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++", "solver_order": 2}),
+    "euler": (EulerDiscreteScheduler, {}),
+    "unipc": (UniPCMultistepScheduler, {}),
+    "ddim": (DDIMScheduler, {}),
+    # Only meaningful with an LCM LoRA active
+    "lcm": (LCMScheduler, {}),
+}
+
+SCHEDULER_ALIASES = {
+    "dpm++_2m": "dpmpp_2m",
+    "dpmsolver": "dpmpp_2m",
+    "euler_discrete": "euler",
+    "uni_pc": "unipc",
+}
+
+
+class UnknownSchedulerError(ValueError):
+    """Raised when a request names a scheduler that is not available."""
+
+
+def normalize_scheduler(name, available=None):
+    """Canonical scheduler name for ``name``; raises UnknownSchedulerError."""
+    key = str(name).strip().lower()
+    key = SCHEDULER_ALIASES.get(key, key)
+    names = SCHEDULERS if available is None else available
+    if key not in names:
+        raise UnknownSchedulerError(
+            f"Unknown scheduler '{name}'. Available: {', '.join(sorted(names))}"
+        )
+    return key
+
+
+def create_scheduler(name, config):
+    """New scheduler instance for ``name`` built from a pipeline's scheduler config."""
+    cls, overrides = SCHEDULERS[normalize_scheduler(name)]
+    return cls.from_config(config, **overrides)
+
+
+def _copy_state(state):
+    # Lists (e.g. DPM++'s model_outputs) are filled in place while stepping
+    return {key: list(value) if isinstance(value, list) else value for key, value in state.items()}
+
+
+class SchedulerRegistry:
+    """
+    Per-thread scheduler instances with cached timestep tables.
+
+    Args:
+        config: Scheduler config of the loaded pipeline.
+        names (list[str]): Schedulers to offer; defaults to all but ``lcm``.
+    """
+
+    def __init__(self, config, names=None):
+        self.config = config
+        if names is None:
+            names = [name for name in SCHEDULERS if name != "lcm"]
+        self.names = list(dict.fromkeys(normalize_scheduler(name.strip()) for name in names))
+        self._tables = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.table_hits = 0
+        self.table_misses = 0
+
+    def normalize(self, name):
+        return normalize_scheduler(name, self.names)
+
+    def get(self, name, steps, device):
+        """
+        Scheduler for one denoising loop, with timesteps already set.
+
+        The instance belongs to the calling thread and is reset on every
+        call, so it must not be used after the loop that asked for it.
+        """
+        name = self.normalize(name)
+        instances = getattr(self._local, "instances", None)
+        if instances is None:
+            instances = self._local.instances = {}
+        scheduler = instances.get(name)
+        if scheduler is None:
+            scheduler = instances[name] = create_scheduler(name, self.config)
+
+        key = (name, int(steps), str(device))
+        with self._lock:
+            state = self._tables.get(key)
+            if state is not None:
+                self.table_hits += 1
+            else:
+                self.table_misses += 1
+        if state is None:
+            scheduler.set_timesteps(int(steps), device=device)
+            state = _copy_state(vars(scheduler))
+            with self._lock:
+                self._tables[key] = state
+        else:
+            vars(scheduler).update(_copy_state(state))
+        return scheduler
+
+    def stats(self):
+        with self._lock:
+            return {
+                "available": list(self.names),
+                "cached_tables": len(self._tables),
+                "table_hits": self.table_hits,
+                "table_misses": self.table_misses,
+            }
+
+
+def step_kwargs(scheduler, generators):
+    """Pass per-image generators to schedulers that draw noise while stepping."""
+    if "generator" in inspect.signature(scheduler.step).parameters:
+        return {"generator": generators}
+    return {}
@@ -7,8 +7,23 @@ import warnings
 from contextlib import redirect_stderr
 import io
 
+try:
+    from pipeline.cache import fingerprint_files
+    from pipeline.cpu import autocast_context, optimize_for_cpu
+    from pipeline.embeddings import PromptEmbeddingCache
+    from pipeline.schedulers import SCHEDULERS, create_scheduler
+except ImportError:  # Run as a script from inside pipeline/
+    from cache import fingerprint_files
+    from cpu import autocast_context, optimize_for_cpu
+    from embeddings import PromptEmbeddingCache
+    from schedulers import SCHEDULERS, create_scheduler
 
-def generate_image(prompt, lora_weights_dir, output_path, steps=30, guidance=7.5, lora_scale=1.0):
+# Text embeddings are reused across calls while the weights stay the same
+_embedding_cache = PromptEmbeddingCache(None, max_entries=32)
+
+
+def generate_image(prompt, lora_weights_dir, output_path, steps=30, guidance=7.5, lora_scale=1.0,
+                   scheduler=None):
     print(f"🚀 Starting image generation...")
     print(f"📝 Prompt: {prompt}")
     print(f"📁 LoRA weights: {lora_weights_dir}")
@@ -17,16 +32,25 @@ def generate_image(prompt, lora_weights_dir, output_path, steps=30, guidance=7.5
     warnings.filterwarnings("ignore", message=".*CLIPTextModel.*")
     warnings.filterwarnings("ignore", message=".*safety_checker.*")
     
+    # fp16 weights are only worthwhile on a GPU; the CPU runs fp32 (with bf16 autocast if supported)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    
     # Load base model with optimized settings
     print("📥 Loading base model...")
     pipe = StableDiffusionPipeline.from_pretrained(
         "runwayml/stable-diffusion-v1-5",
-        torch_dtype=torch.float16,
+        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
         safety_checker=None,
         requires_safety_checker=False,
         use_safetensors=True,
-        variant="fp16"
-    ).to("cpu")
+        variant="fp16" if device == "cuda" else None
+    ).to(device)
+
+    # The checkpoint's own scheduler unless one is asked for; pass
+    # "dpmpp_2m" to match the server's default
+    if scheduler is not None:
+        pipe.scheduler = create_scheduler(scheduler, pipe.scheduler.config)
+    print(f"✅ Scheduler: {scheduler or type(pipe.scheduler).__name__}")
 
     # Find and load LoRA weights
     print("🔍 Looking for LoRA weights...")
@@ -77,17 +101,25 @@ def generate_image(prompt, lora_weights_dir, output_path, steps=30, guidance=7.5
         print(f"❌ Error loading LoRA weights: {e}")
         raise
 
-    # Memory optimization
-    print("⚡ Optimizing memory usage...")
-    try:
-        pipe.enable_xformers_memory_efficient_attention()
-        print("✅ xformers memory optimization enabled")
-    except:
+    use_bf16 = False
+    if device == "cpu":
+        # A single image does not amortize torch.compile, so only cheap CPU optimizations
+        print("⚡ Applying CPU execution mode...")
+        settings = optimize_for_cpu(pipe, channels_last=True, bf16="auto", compile=False)
+        use_bf16 = settings["bf16"]
+        print(f"✅ CPU mode: {settings}")
+    else:
+        # Memory optimization
+        print("⚡ Optimizing memory usage...")
         try:
-            pipe.enable_model_cpu_offload()
-            print("✅ CPU offload enabled for memory optimization")
+            pipe.enable_xformers_memory_efficient_attention()
+            print("✅ xformers memory optimization enabled")
         except:
-            print("⚠️  Using standard memory configuration")
+            try:
+                pipe.enable_model_cpu_offload()
+                print("✅ CPU offload enabled for memory optimization")
+            except:
+                print("⚠️  Using standard memory configuration")
 
     # Generate image
     print(f"🎨 Generating image... (steps: {steps}, guidance: {guidance})")
@@ -95,9 +127,14 @@ def generate_image(prompt, lora_weights_dir, output_path, steps=30, guidance=7.5
     # Clear GPU cache before generation
     torch.cuda.empty_cache()
     
-    with torch.inference_mode():
+    _embedding_cache.bind(pipe, f"runwayml/stable-diffusion-v1-5:{fingerprint_files(lora_weights_dir)}")
+    prompt_embeds = _embedding_cache.encode([prompt])
+    negative_prompt_embeds = _embedding_cache.encode([""])
+    
+    with torch.inference_mode(), autocast_context(device, use_bf16):
         image = pipe(
-            prompt, 
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_prompt_embeds,
             num_inference_steps=steps, 
             guidance_scale=guidance,
             height=512,
@@ -110,6 +147,7 @@ def generate_image(prompt, lora_weights_dir, output_path, steps=30, guidance=7.5
     print(f"✅ Image saved to {output_path}")
     
     # Clean up memory
+    _embedding_cache.bind(None, _embedding_cache.fingerprint)
     del pipe
     torch.cuda.empty_cache()
     
@@ -124,6 +162,8 @@ if __name__ == "__main__":
     parser.add_argument("--steps", type=int, default=30, help="Number of inference steps")
     parser.add_argument("--guidance", type=float, default=7.5, help="Guidance scale")
     parser.add_argument("--lora_scale", type=float, default=1.0, help="LoRA scale (0.0-2.0)")
+    parser.add_argument("--scheduler", type=str, default=None, choices=sorted(SCHEDULERS),
+                        help="Noise scheduler (default: the model's own; the server uses dpmpp_2m)")
 
     args = parser.parse_args()
     
@@ -134,7 +174,8 @@ if __name__ == "__main__":
             args.output,
             steps=args.steps,
             guidance=args.guidance,
-            lora_scale=args.lora_scale
+            lora_scale=args.lora_scale,
+            scheduler=args.scheduler
         )
         print(f"\n🎉 Generation completed successfully!")
         print(f"📸 Image saved at: {output_path}")
@@ -8,7 +8,6 @@ A command-line interface for the Pottery Image Generator API.
 import argparse
 import requests
 import json
-import base64
 import sys
 import os
 from PIL import Image
@@ -52,7 +51,8 @@ class PotteryGeneratorCLI:
             "steps": steps,
             "guidance_scale": guidance_scale,
             "width": width,
-            "height": height
+            "height": height,
+            "format": "png"  # Raw image bytes, metadata in headers
         }
         
         if seed is not None:
@@ -72,7 +72,16 @@ class PotteryGeneratorCLI:
             )
             
             if response.status_code == 200:
-                result = response.json()
+                result = {
+                    "prompt": prompt,
+                    "seed": response.headers.get("X-Seed"),
+                    "parameters": {
+                        "steps": response.headers.get("X-Steps"),
+                        "guidance_scale": response.headers.get("X-Guidance-Scale"),
+                        "width": response.headers.get("X-Width"),
+                        "height": response.headers.get("X-Height")
+                    }
+                }
                 
                 # Save image
                 if not output_file:
@@ -81,16 +90,12 @@ class PotteryGeneratorCLI:
                     safe_prompt = "_".join(safe_prompt.split())
                     output_file = f"pottery_{safe_prompt}_{timestamp}.png"
                 
-                # Decode and save image
-                image_data = result["image"].split(",")[1]  # Remove data:image/png;base64,
-                image_bytes = base64.b64decode(image_data)
-                
                 with open(output_file, 'wb') as f:
-                    f.write(image_bytes)
+                    f.write(response.content)
                 
                 print(f"✅ Image generated successfully!")
                 print(f"   Saved as: {output_file}")
-                print(f"   Used seed: {result.get('seed', 'Random')}")
+                print(f"   Used seed: {result.get('seed') or 'Random'}")
                 
                 return output_file, result
                 
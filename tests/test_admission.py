@@ -0,0 +1,126 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import admission as admission_module
+from pipeline.admission import AdmissionController, BudgetExceededError, request_cost
+from pipeline.batching import BatchScheduler, GenerationRequest
+from pipeline.jobs import JobQueue, QueueFullError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission_module, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def make_request(prompt="vase", steps=20, width=512, height=512):
+    return GenerationRequest(prompt=prompt, negative_prompt="", steps=steps, width=width, height=height)
+
+
+def cost_of(r):
+    return request_cost(r.steps, r.width, r.height, r.batch_size)
+
+
+def test_cost_is_counted_in_512_steps():
+    assert request_cost(20, 512, 512) == 20
+    assert request_cost(50, 1024, 1024) == 200
+    assert request_cost(10, 512, 768, batch_size=2) == 30
+
+
+def test_inflight_cost_is_capped():
+    controller = AdmissionController(max_inflight_cost=100)
+    controller.admit("a", 60)
+    with pytest.raises(BudgetExceededError) as e:
+        controller.admit("b", 50, retry_after=7)
+    assert isinstance(e.value, QueueFullError)
+    assert e.value.retry_after == 7
+    controller.release(60)
+    controller.admit("b", 50)
+    assert controller.stats()["inflight_cost"] == 50
+    assert controller.stats()["rejected"] == 1
+
+
+def test_request_larger_than_any_limit_is_invalid():
+    with pytest.raises(ValueError):
+        AdmissionController(max_inflight_cost=100).check_request(101)
+    with pytest.raises(ValueError):
+        AdmissionController(client_budget=100).admit("a", 101)
+
+
+def test_client_budget_rejects_then_refills(clock):
+    controller = AdmissionController(client_budget=100, client_refill=10)
+    controller.admit("a", 80)
+    with pytest.raises(BudgetExceededError) as e:
+        controller.admit("a", 50)
+    # 20 units left, 30 short at 10 units per second
+    assert e.value.retry_after == 3
+    # Other clients have their own bucket
+    controller.admit("b", 100)
+
+    clock.now += 3
+    controller.admit("a", 50)
+    clock.now += 1000
+    # Buckets never fill past the budget
+    controller.admit("a", 60)
+    with pytest.raises(BudgetExceededError):
+        controller.admit("a", 60)
+
+
+def test_job_releases_its_cost_when_it_ends():
+    controller = AdmissionController(max_inflight_cost=50)
+    batcher = BatchScheduler(lambda requests: [], max_batch_size=2)
+    jobs = JobQueue(batcher, admission=controller, cost_fn=cost_of)
+    done = jobs.submit(make_request("done"))
+    cancelled = jobs.submit(make_request("cancelled"))
+    assert controller.inflight_cost == 40
+    with pytest.raises(BudgetExceededError):
+        jobs.submit(make_request("over", steps=20))
+
+    done.future.set_running_or_notify_cancel()
+    done.future.set_result("image")
+    assert controller.inflight_cost == 20
+    assert jobs.cancel(cancelled)
+    assert controller.inflight_cost == 0
+    # The next request fits again and nothing rejected was charged
+    jobs.submit(make_request("next", steps=50))
+    assert controller.inflight_cost == 50
+
+
+def test_shared_limits_still_accept_requests_larger_than_a_share():
+    # One of four workers enforcing a server-wide limit of 1000 units
+    controller = AdmissionController(max_inflight_cost=1000, shares=4)
+    big = request_cost(50, 1024, 1024, batch_size=2)
+    assert big == 400
+    controller.check_request(big)
+    controller.admit("a", 10)
+    # Busy: retry later rather than a permanent rejection
+    with pytest.raises(BudgetExceededError) as e:
+        controller.admit("b", big, retry_after=5)
+    assert e.value.retry_after == 5
+    controller.release(10)
+    controller.admit("b", big)
+    with pytest.raises(ValueError):
+        controller.check_request(1001)
+    assert controller.stats()["max_inflight_cost"] == 250
+
+
+def test_shared_client_budget_goes_into_debt(clock):
+    controller = AdmissionController(client_budget=400, client_refill=4, shares=4)
+    # A bucket of 100 refilling at 1 unit per second
+    controller.admit("a", 300)
+    with pytest.raises(BudgetExceededError) as e:
+        controller.admit("a", 10)
+    # 200 units of debt to repay before anything else is admitted
+    assert e.value.retry_after == 210
+    clock.now += 400
+    controller.admit("a", 300)
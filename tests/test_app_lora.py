@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("peft")
+import torch
+from diffusers import AutoencoderKL, PNDMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+from peft import LoraConfig
+from peft.tuners.lora import LoraLayer
+from peft.utils import get_peft_model_state_dict
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docker"))
+import app  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    """A randomly initialised miniature Stable Diffusion model and a LoRA for it."""
+    root = tmp_path_factory.mktemp("tiny_sd")
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64), layers_per_block=1, sample_size=8, in_channels=4, out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32, attention_head_dim=4, norm_num_groups=8,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=(16, 32), in_channels=3, out_channels=3, latent_channels=4, norm_num_groups=8,
+        down_block_types=("DownEncoderBlock2D",) * 2, up_block_types=("UpDecoderBlock2D",) * 2,
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0, eos_token_id=2, pad_token_id=1, hidden_size=32, intermediate_size=37,
+        num_attention_heads=4, num_hidden_layers=2, vocab_size=100,
+    ))
+    vocab = {"<|startoftext|>": 0, "!": 1, "<|endoftext|>": 2}
+    for i, letter in enumerate("abcdefghijklmnopqrstuvwxyz"):
+        vocab[letter] = 3 + i
+        vocab[f"{letter}</w>"] = 40 + i
+    (root / "vocab.json").write_text(json.dumps(vocab))
+    (root / "merges.txt").write_text("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(str(root / "vocab.json"), str(root / "merges.txt"))
+    pipe = StableDiffusionPipeline(
+        unet=unet, vae=vae, text_encoder=text_encoder, tokenizer=tokenizer,
+        scheduler=PNDMScheduler(skip_prk_steps=True), safety_checker=None, feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    pipe.save_pretrained(str(root / "model"))
+    pipe.unet.add_adapter(LoraConfig(r=4, lora_alpha=4, target_modules=["to_q", "to_k", "to_v", "to_out.0"],
+                                     init_lora_weights=False))
+    StableDiffusionPipeline.save_lora_weights(str(root / "lora"), unet_lora_layers=get_peft_model_state_dict(pipe.unet))
+    return root
+
+
+def test_unfused_lora_runs_at_the_reported_scale(tiny_model, tmp_path, monkeypatch):
+    for name, value in {
+        "MODEL_ID": str(tiny_model / "model"), "LORA_DIR": str(tiny_model / "lora"), "LORA_FUSE": False,
+        "LORA_SCALE": 0.5, "LORA_ADAPTERS": "", "LORA_ADAPTERS_DIR": "", "LCM_LORA_DIR": "",
+        "QUANTIZE_INT8": False, "CPU_COMPILE": False, "MEMORY_BUDGET_MB": "0",
+        "COST_MODEL_PATH": str(tmp_path / "cost.json"),
+    }.items():
+        monkeypatch.setattr(app, name, value)
+    app.load_pipeline()
+
+    layers = [m for m in app.pipe.unet.modules() if isinstance(m, LoraLayer)]
+    assert layers
+    for layer in layers:
+        for scaling in layer.scaling.values():
+            # peft scales by weight * alpha / r; alpha == r here
+            assert scaling == pytest.approx(0.5)
+
+    health = app.app.test_client().get("/api/health").get_json()
+    assert health["lora"] == {"fused": False, "scale": 0.5}
+    assert app.current_fingerprint().endswith(":scale=0.5")
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pytest
+
+from pipeline.batching import BatchScheduler, GenerationCancelled, GenerationRequest
+
+
+def make_request(prompt="vase", steps=20, width=512, height=512, seed=None):
+    return GenerationRequest(prompt=prompt, negative_prompt="", seed=seed,
+                             steps=steps, width=width, height=height)
+
+
+class Runner:
+    """Stub run_batch that records every batch and returns one string per request."""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+        self.started = threading.Event()
+
+    def __call__(self, requests):
+        self.batches.append([r.prompt for r in requests])
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        return [f"image:{r.prompt}" for r in requests]
+
+
+def test_compatible_requests_share_a_batch():
+    runner = Runner()
+    batcher = BatchScheduler(runner, max_batch_size=4, max_wait=0.2)
+    requests = [make_request("a"), make_request("b"), make_request("c", steps=30), make_request("d")]
+    batcher.submit_many(requests)
+    batcher.start()
+    try:
+        results = [r.future.result(timeout=5) for r in requests]
+    finally:
+        batcher.stop()
+    assert sorted(map(sorted, runner.batches)) == [["a", "b", "d"], ["c"]]
+    # Every future gets its own request's result, whatever batch it ran in
+    assert results == ["image:a", "image:b", "image:c", "image:d"]
+
+
+def test_batches_are_capped_at_max_batch_size():
+    runner = Runner()
+    batcher = BatchScheduler(runner, max_batch_size=2, max_wait=0.2)
+    requests = [make_request(str(i)) for i in range(5)]
+    batcher.submit_many(requests)
+    batcher.start()
+    try:
+        for r in requests:
+            r.future.result(timeout=5)
+    finally:
+        batcher.stop()
+    assert [len(batch) for batch in runner.batches] == [2, 2, 1]
+
+
+def test_cancelled_before_batch_is_dropped():
+    runner = Runner()
+    cancelled = []
+    batcher = BatchScheduler(runner, max_wait=0.05, on_cancel=lambda r, reason: cancelled.append(reason))
+    keep, drop = make_request("keep"), make_request("drop")
+    batcher.submit_many([keep, drop])
+    assert drop.cancel()
+    batcher.start()
+    try:
+        assert keep.future.result(timeout=5) == "image:keep"
+    finally:
+        batcher.stop()
+    assert drop.future.cancelled()
+    assert runner.batches == [["keep"]]
+    assert cancelled == ["cancelled"]
+
+
+def test_cancelled_during_batch_gets_error_others_result():
+    gate = threading.Event()
+    runner = Runner(gate)
+    batcher = BatchScheduler(runner, max_wait=0.05).start()
+    keep, drop = make_request("keep"), make_request("drop")
+    batcher.submit_many([keep, drop])
+    try:
+        assert runner.started.wait(5)
+        # Running futures cannot be cancelled; the result is discarded afterwards
+        drop.cancel()
+        gate.set()
+        assert keep.future.result(timeout=5) == "image:keep"
+        with pytest.raises(GenerationCancelled):
+            drop.future.result(timeout=5)
+    finally:
+        batcher.stop()
+
+
+def test_whole_batch_cancelled_mid_run():
+    def run_batch(requests):
+        # What the server's step callback does once every request has gone away
+        for r in requests:
+            r.cancel("disconnected")
+        raise GenerationCancelled()
+
+    batcher = BatchScheduler(run_batch, max_wait=0.05).start()
+    r = make_request()
+    batcher.submit(r)
+    try:
+        with pytest.raises(GenerationCancelled) as e:
+            r.future.result(timeout=5)
+    finally:
+        batcher.stop()
+    assert e.value.reason == "disconnected"
+
+
+def test_expired_deadline_is_dropped_before_running():
+    runner = Runner()
+    reasons = []
+    batcher = BatchScheduler(runner, max_wait=0.05, on_cancel=lambda r, reason: reasons.append(reason))
+    late, on_time = make_request("late"), make_request("on_time")
+    late.deadline = time.monotonic() - 1
+    on_time.deadline = time.monotonic() + 60
+    batcher.submit_many([late, on_time])
+    batcher.start()
+    try:
+        assert on_time.future.result(timeout=5) == "image:on_time"
+        with pytest.raises(GenerationCancelled) as e:
+            late.future.result(timeout=5)
+    finally:
+        batcher.stop()
+    assert e.value.reason == "deadline"
+    assert runner.batches == [["on_time"]]
+    assert reasons == ["deadline"]
+
+
+def test_expired_request_alone_in_queue_is_resolved():
+    batcher = BatchScheduler(Runner(), max_wait=0.05).start()
+    r = make_request()
+    r.deadline = time.monotonic() - 1
+    batcher.submit(r)
+    try:
+        with pytest.raises(GenerationCancelled):
+            r.future.result(timeout=5)
+    finally:
+        batcher.stop()
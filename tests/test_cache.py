@@ -0,0 +1,62 @@
+from PIL import Image
+
+from pipeline.batching import GenerationRequest
+from pipeline.cache import ResultCache
+
+
+def make_request(**overrides):
+    fields = dict(prompt="blue  vase", negative_prompt="blurry", guidance_scale=7.5,
+                  seed=42, steps=20, width=512, height=512)
+    fields.update(overrides)
+    return GenerationRequest(**fields)
+
+
+def solid(color):
+    return Image.new("RGB", (8, 8), color)
+
+
+def test_key_is_stable_across_equivalent_requests():
+    cache = ResultCache("weights-a")
+    key = cache.key_for(make_request())
+    # Whitespace in prompts and int/float spelling of parameters do not matter
+    assert cache.key_for(make_request(prompt=" blue vase ", guidance_scale=7.50000001)) == key
+    assert cache.key_for(make_request(guidance_scale=7)) != key
+    assert cache.key_for(make_request(seed=43)) != key
+    assert ResultCache("weights-b").key_for(make_request()) != key
+
+
+def test_unseeded_requests_are_not_cached():
+    assert ResultCache("weights").key_for(make_request(seed=None)) is None
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache("weights", max_entries=2)
+    cache.put("a", solid("red"))
+    cache.put("b", solid("green"))
+    # Touching "a" makes "b" the eviction candidate
+    assert cache.get("a") is not None
+    cache.put("c", solid("blue"))
+    assert cache.get("b") is None
+    assert cache.get("a").getpixel((0, 0)) == (255, 0, 0)
+    assert cache.get("c").getpixel((0, 0)) == (0, 0, 255)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["memory_entries"]) == (3, 1, 2)
+
+
+def test_disk_tier_round_trip(tmp_path):
+    cache = ResultCache("weights", max_entries=1, disk_dir=str(tmp_path))
+    cache.put("a", solid("red"))
+    cache.put("b", solid("green"))
+    # "a" left memory but is read back from disk
+    assert cache.get("a").getpixel((0, 0)) == (255, 0, 0)
+
+    reopened = ResultCache("weights", max_entries=1, disk_dir=str(tmp_path))
+    assert reopened.stats()["disk_entries"] == 2
+    assert reopened.get("b").getpixel((0, 0)) == (0, 128, 0)
+
+
+def test_disk_tier_is_bounded_by_size(tmp_path):
+    cache = ResultCache("weights", max_entries=0, disk_dir=str(tmp_path), disk_max_bytes=1)
+    cache.put("a", solid("red"))
+    assert cache.stats()["disk_entries"] == 0
+    assert cache.get("a") is None
@@ -0,0 +1,81 @@
+import random
+import time
+
+import pytest
+
+from pipeline.batching import BatchScheduler, GenerationRequest
+from pipeline.cost_model import CostModel
+from pipeline.jobs import JobQueue
+
+SHAPES = [(512, 512, 1), (512, 512, 4), (768, 768, 1), (1024, 1024, 2), (512, 768, 3)]
+
+
+def observe_synthetic(model, step_base, step_per_unit, decode_per_unit, overhead, count, noise=0.0):
+    rng = random.Random(0)
+    for i in range(count):
+        width, height, batch = SHAPES[i % len(SHAPES)]
+        work = width * height / (512 * 512) * batch
+        step = (step_base + step_per_unit * work) * (1 + rng.uniform(-noise, noise))
+        decode = decode_per_unit * work
+        steps = 20
+        model.observe(steps, width, height, batch, step, decode, overhead + steps * step + decode)
+
+
+def test_fit_converges_on_synthetic_timings():
+    model = CostModel()
+    observe_synthetic(model, step_base=0.2, step_per_unit=0.7, decode_per_unit=1.5, overhead=0.3,
+                      count=40, noise=0.02)
+    assert model.source == "observed"
+    assert model.step_base == pytest.approx(0.2, abs=0.03)
+    assert model.step_per_unit == pytest.approx(0.7, rel=0.03)
+    assert model.decode_per_unit == pytest.approx(1.5, rel=0.01)
+    assert model.overhead == pytest.approx(0.3, abs=0.01)
+    # 30 steps of a 1024x1024 pair: 0.3 + 30 * (0.2 + 0.7 * 8) + 1.5 * 8
+    assert model.predict_seconds(30, 1024, 1024, 2) == pytest.approx(186.3, rel=0.03)
+
+
+def test_fit_follows_a_change_of_host():
+    model = CostModel()
+    observe_synthetic(model, 0.2, 0.7, 1.5, 0.3, count=40)
+    # Recent batches outweigh old ones, e.g. after the server got slower cores
+    observe_synthetic(model, 0.4, 1.4, 3.0, 0.6, count=60)
+    assert model.step_per_unit == pytest.approx(1.4, rel=0.05)
+    assert model.step_base == pytest.approx(0.4, abs=0.05)
+
+
+def test_single_shape_attributes_step_time_to_work():
+    model = CostModel()
+    model.observe(20, 512, 512, 2, step_seconds=1.0, decode_seconds=2.0, total_seconds=23.0)
+    assert (model.step_base, model.step_per_unit) == (0.0, 0.5)
+
+
+def test_calibration_round_trip(tmp_path):
+    model = CostModel()
+    observe_synthetic(model, 0.2, 0.7, 1.5, 0.3, count=10)
+    path = str(tmp_path / "cost.json")
+    model.save(path)
+    loaded = CostModel()
+    assert loaded.load(path)
+    assert loaded.predict_seconds(25, 768, 512, 3) == pytest.approx(model.predict_seconds(25, 768, 512, 3))
+    assert not CostModel().load(str(tmp_path / "missing.json"))
+
+
+def test_queued_job_eta_uses_the_model():
+    model = CostModel()
+    batcher = BatchScheduler(lambda requests: [], max_batch_size=2)
+    jobs = JobQueue(batcher, estimate_fn=model.predict_seconds)
+    small = [jobs.submit(GenerationRequest(prompt=str(i), negative_prompt="", steps=20)) for i in range(3)]
+    large = jobs.submit(GenerationRequest(prompt="large", negative_prompt="", steps=30, width=1024, height=1024))
+
+    # Two batches of compatible requests ahead: a pair, then the third alone
+    pair, single = model.predict_seconds(20, 512, 512, 2), model.predict_seconds(20, 512, 512, 1)
+    assert jobs.eta(small[2]) == pytest.approx(pair + single)
+    assert jobs.eta(large) == pytest.approx(pair + single + model.predict_seconds(30, 1024, 1024, 1))
+    assert jobs.backlog_seconds() == pytest.approx(jobs.eta(large))
+
+    # A running job counts only its remaining time
+    started = time.monotonic() - 5
+    for job in small[:2]:
+        # What the batcher records when the pair starts
+        job.request.started_at, job.request.batch_size = started, 2
+    assert jobs.eta(small[0]) == pytest.approx(pair - 5, abs=0.5)
@@ -0,0 +1,162 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+from PIL import Image
+
+from pipeline.batching import BatchScheduler, GenerationCancelled, GenerationRequest
+from pipeline.cache import ResultCache
+from pipeline.encoding import EncoderPool
+from pipeline.jobs import JobQueue, QueueFullError
+
+
+def make_request(prompt="vase", seed=None, steps=20):
+    return GenerationRequest(prompt=prompt, negative_prompt="", seed=seed, steps=steps)
+
+
+def idle_batcher(max_batch_size=2):
+    # Never started: submitted requests stay queued until a test resolves them
+    return BatchScheduler(lambda requests: [], max_batch_size=max_batch_size)
+
+
+def finish(job, result="image"):
+    job.future.set_running_or_notify_cancel()
+    job.future.set_result(result)
+
+
+def test_depth_counts_unfinished_jobs():
+    jobs = JobQueue(idle_batcher(), max_depth=4)
+    first = jobs.submit(make_request("a"))
+    second = jobs.submit(make_request("b"), track=False)
+    assert jobs.depth() == 2
+    finish(first)
+    assert jobs.depth() == 1
+    assert jobs.get(first.id).status == "done"
+    finish(second)
+    assert jobs.depth() == 0
+    # Untracked jobs are not kept once they finish
+    assert jobs.get(second.id) is None
+
+
+def test_full_queue_rejects_with_retry_after():
+    jobs = JobQueue(idle_batcher(max_batch_size=2), max_depth=3)
+    jobs.submit_many([make_request(str(i)) for i in range(3)])
+    with pytest.raises(QueueFullError) as e:
+        jobs.submit(make_request("overflow"))
+    # Two batches ahead at the default 30 s per batch
+    assert e.value.retry_after == 60
+    assert jobs.depth() == 3
+
+
+def test_group_is_admitted_whole_or_not_at_all():
+    batcher = idle_batcher()
+    jobs = JobQueue(batcher, max_depth=3)
+    jobs.submit(make_request("a"))
+    with pytest.raises(QueueFullError):
+        jobs.submit_many([make_request("b"), make_request("c"), make_request("d")])
+    assert jobs.depth() == 1
+    assert batcher.queue_depth() == 1
+    jobs.submit_many([make_request("b"), make_request("c")])
+    assert jobs.depth() == 3
+
+
+def test_cancelled_job_frees_its_slot():
+    jobs = JobQueue(idle_batcher(), max_depth=1)
+    job = jobs.submit(make_request())
+    assert jobs.cancel(job)
+    assert job.status == "cancelled"
+    assert jobs.depth() == 0
+    jobs.submit(make_request("next"))
+
+
+def test_cache_entry_is_encoded_off_the_finishing_thread():
+    cache = ResultCache("weights")
+    stored = []
+    done = threading.Event()
+    put_encoded = cache.put_encoded
+
+    def record(key, data):
+        stored.append(threading.current_thread().name)
+        put_encoded(key, data)
+        done.set()
+
+    cache.put_encoded = record
+    jobs = JobQueue(idle_batcher(), cache=cache, encoder=EncoderPool(1))
+    job = jobs.submit(make_request(seed=1))
+    finish(job, Image.new("RGB", (8, 8), "red"))
+    assert done.wait(5)
+    assert stored[0].startswith("encoder")
+    assert cache.get(cache.key_for(job.request)).getpixel((0, 0)) == (255, 0, 0)
+
+
+def test_result_is_served_while_its_cache_entry_is_encoding():
+    class PendingEncoder:
+        def __init__(self):
+            self.future = Future()
+
+        def submit(self, image, fmt):
+            return self.future
+
+    encoder = PendingEncoder()
+    cache = ResultCache("weights")
+    jobs = JobQueue(idle_batcher(), cache=cache, encoder=encoder)
+    image = Image.new("RGB", (8, 8), "red")
+    finish(jobs.submit(make_request(seed=1)), image)
+    # Neither in flight nor in the cache yet, but not generated again
+    again = jobs.submit(make_request(seed=1))
+    assert again.status == "done" and again.result() is image
+    assert jobs.batcher.queue_depth() == 1
+
+    encoder.future.set_result((b"png", "image/png", "png"))
+    assert cache.stats()["memory_entries"] == 1
+    assert jobs._encoding == {}
+
+
+class GatedRunner:
+    """run_batch stub that holds every batch until ``gate`` is set."""
+
+    def __init__(self):
+        self.runs = 0
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self, requests):
+        self.runs += 1
+        self.started.set()
+        self.gate.wait(5)
+        return [Image.new("RGB", (8, 8), "red") for _ in requests]
+
+
+def test_follower_keeps_a_cancelled_leaders_generation():
+    runner = GatedRunner()
+    batcher = BatchScheduler(runner, max_wait=0.01).start()
+    jobs = JobQueue(batcher, cache=ResultCache("weights"))
+    try:
+        leader = jobs.submit(make_request(seed=1))
+        assert runner.started.wait(5)
+        follower = jobs.submit(make_request(seed=1))
+        assert follower.leader is leader
+
+        assert jobs.cancel(leader, "disconnected")
+        assert leader.status == "cancelled"
+        assert not jobs.cancel(leader)
+        assert follower.status == "running"
+        runner.gate.set()
+        assert follower.future.result(timeout=5).getpixel((0, 0)) == (255, 0, 0)
+    finally:
+        batcher.stop()
+    assert runner.runs == 1
+    with pytest.raises(GenerationCancelled):
+        leader.result()
+    assert "disconnected" in leader.error()
+
+
+def test_generation_stops_once_its_last_follower_leaves():
+    jobs = JobQueue(idle_batcher(), cache=ResultCache("weights"))
+    leader = jobs.submit(make_request(seed=1))
+    follower = jobs.submit(make_request(seed=1))
+    assert jobs.cancel(leader)
+    assert leader.request.cancel_reason() is None
+    assert jobs.cancel(follower)
+    assert leader.request.cancel_reason() == "cancelled"
+    assert jobs.depth() == 0
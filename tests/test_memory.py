@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline.cost_model import CostModel
+from pipeline.memory import MemoryBudgetError, MemoryPolicy
+
+
+class FakeVae:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def enable_slicing(self):
+        self.calls.append("enable_vae_slicing")
+
+    def disable_slicing(self):
+        self.calls.append("disable_vae_slicing")
+
+    def enable_tiling(self):
+        self.calls.append("enable_vae_tiling")
+
+    def disable_tiling(self):
+        self.calls.append("disable_vae_tiling")
+
+
+def fake_pipe():
+    calls = []
+    return SimpleNamespace(
+        calls=calls,
+        vae=FakeVae(calls),
+        enable_attention_slicing=lambda: calls.append("enable_attention_slicing"),
+        disable_attention_slicing=lambda: calls.append("disable_attention_slicing"),
+    )
+
+
+def policy_for(budget_shape, quadratic_attention=False):
+    """A policy whose budget is exactly what ``budget_shape`` needs with no options."""
+    model = CostModel(weights_bytes=2 * 2**30, quadratic_attention=quadratic_attention)
+    return MemoryPolicy(fake_pipe(), model, model.predict_peak_bytes(*budget_shape))
+
+
+def test_no_budget_never_enables_options():
+    policy = MemoryPolicy(fake_pipe(), CostModel(), None)
+    assert policy.plan(2048, 2048, 8) == {}
+    assert policy.max_batch_size(2048, 2048, 8) == 8
+
+
+def test_options_turn_on_only_above_the_budget():
+    policy = policy_for((512, 512, 1))
+    assert policy.plan(512, 512, 1) == {}
+    # Two images no longer fit in one decode; decoding them one at a time does
+    assert policy.plan(512, 512, 2) == {"vae_slicing": True}
+    # A larger image needs its decode tiled as well
+    assert policy.plan(768, 768, 1) == {"vae_slicing": True, "vae_tiling": True}
+    assert policy.fits(768, 768, 1, policy.plan(768, 768, 1))
+    assert not policy.fits(768, 768, 1)
+
+
+def test_attention_slicing_is_the_last_resort():
+    policy = policy_for((512, 512, 1), quadratic_attention=True)
+    assert policy.plan(512, 512, 1) == {}
+    options = policy.plan(640, 640, 1)
+    assert options["attention_slicing"]
+
+    compiled = MemoryPolicy(fake_pipe(), policy.cost_model, policy.budget_bytes, allow_attention_slicing=False)
+    assert compiled.plan(640, 640, 1) is None
+    with pytest.raises(MemoryBudgetError):
+        compiled.check(640, 640)
+
+
+def test_apply_only_touches_what_changes():
+    policy = policy_for((512, 512, 1))
+    policy.apply({})
+    assert policy.pipe.calls == []
+    policy.apply(policy.plan(768, 768, 1))
+    policy.apply(policy.plan(768, 768, 1))
+    assert policy.pipe.calls == ["enable_vae_slicing", "enable_vae_tiling"]
+    policy.apply(policy.plan(512, 512, 1))
+    assert policy.pipe.calls[2:] == ["disable_vae_slicing", "disable_vae_tiling"]
+    assert policy.state()["switches"] == 4
+    assert policy.state()["applied"] == {}
+
+
+def test_oversized_batches_are_split():
+    policy = policy_for((512, 512, 1))
+    chunk = policy.max_batch_size(512, 512, 16)
+    # The largest batch that fits with some options, and no larger
+    assert 1 < chunk < 16
+    assert policy.plan(512, 512, chunk) is not None
+    assert policy.plan(512, 512, chunk + 1) is None
+    # Never below one image, even when a single image is over budget
+    assert policy.max_batch_size(4096, 4096, 4) == 1
+    assert policy.max_batch_size(512, 512, 1) == 1
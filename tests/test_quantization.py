@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import torch
+from torch import nn
+
+from pipeline.cost_model import module_bytes
+from pipeline.quantization import _swap_linear_layers, quantize_module, quantize_pipeline
+
+
+class WrappedLinear(nn.Linear):
+    """Stands in for LoRA-style subclasses of nn.Linear."""
+
+
+def tiny_model():
+    return nn.Sequential(nn.Linear(16, 16), nn.ReLU(), WrappedLinear(16, 8))
+
+
+def test_swap_matches_quantize_dynamic_layer_selection():
+    quantized = quantize_module(tiny_model())
+    swapped = _swap_linear_layers(tiny_model())
+    assert [type(m) for m in swapped] == [type(m) for m in quantized]
+    assert type(swapped[2]) is WrappedLinear
+
+
+def test_module_bytes_counts_packed_int8_weights():
+    model = nn.Sequential(nn.Linear(64, 64), nn.ReLU(), nn.Linear(64, 32))
+    assert module_bytes(model) == (64 * 64 + 64 + 64 * 32 + 32) * 4
+    quantize_module(model)
+    # int8 weights, fp32 biases
+    assert module_bytes(model) == 64 * 64 + 64 * 32 + (64 + 32) * 4
+
+
+def test_cached_weights_round_trip(tmp_path):
+    torch.manual_seed(0)
+    path = str(tmp_path / "int8.pt")
+    first = SimpleNamespace(unet=tiny_model(), text_encoder=tiny_model())
+    second = SimpleNamespace(unet=tiny_model(), text_encoder=tiny_model())
+    second.unet.load_state_dict(first.unet.state_dict())
+    second.text_encoder.load_state_dict(first.text_encoder.state_dict())
+
+    assert quantize_pipeline(first, path) is False
+    assert quantize_pipeline(second, path) is True
+    x = torch.randn(2, 16)
+    assert torch.equal(first.unet(x), second.unet(x))